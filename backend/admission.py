@@ -0,0 +1,208 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, Optional
+
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted in time"""
+
+    def __init__(self, limiter: str, reason: str, retry_after_s: float):
+        super().__init__(f"{limiter} overloaded: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded FIFO wait queue.
+
+    A request is rejected up front when the queue is full or when the
+    estimated wait (from recent service times) already exceeds its deadline,
+    rather than queueing work that will time out anyway.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait_s: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.active = 0
+        self._waiters = deque()
+        # Exponential moving average of how long a request holds its slot
+        self._service_time_s: Optional[float] = None
+        self.metrics = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected_queue_full': 0,
+            'rejected_deadline': 0,
+            'rejected_timeout': 0,
+            'total_wait_s': 0.0,
+            'max_queue_depth': 0
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait_s(self, position: int) -> float:
+        """Expected wait for the request at this queue position"""
+        if self._service_time_s is None:
+            return 0.0
+        return self._service_time_s * math.ceil(position / self.max_concurrent)
+
+    def _reject(self, reason: str, retry_after_s: float) -> AdmissionRejected:
+        self.metrics[f'rejected_{reason}'] += 1
+        return AdmissionRejected(self.name, reason, max(1.0, retry_after_s))
+
+    async def acquire(self, deadline_s: Optional[float] = None):
+        """Wait for a slot, raising AdmissionRejected when none is available in time"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.metrics['admitted'] += 1
+            return
+
+        max_wait_s = self.max_wait_s if deadline_s is None else min(self.max_wait_s, deadline_s)
+        position = len(self._waiters) + 1
+        estimated_wait = self.estimated_wait_s(position)
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject('queue_full', estimated_wait)
+        if estimated_wait > max_wait_s:
+            raise self._reject('deadline', estimated_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.metrics['queued'] += 1
+        self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], len(self._waiters))
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(waiter, timeout=max_wait_s)
+        except asyncio.TimeoutError:
+            self._remove_waiter(waiter)
+            raise self._reject('timeout', self.estimated_wait_s(len(self._waiters) + 1))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self._remove_waiter(waiter)
+            raise
+
+        self.metrics['admitted'] += 1
+        self.metrics['total_wait_s'] += time.monotonic() - started
+
+    def _remove_waiter(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, service_time_s: Optional[float] = None):
+        """Free a slot, handing it directly to the oldest waiter"""
+        if service_time_s is not None:
+            if self._service_time_s is None:
+                self._service_time_s = service_time_s
+            else:
+                self._service_time_s = 0.8 * self._service_time_s + 0.2 * service_time_s
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued = self.metrics['queued']
+        return {
+            **self.metrics,
+            'active': self.active,
+            'queue_depth': len(self._waiters),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'avg_wait_ms': self.metrics['total_wait_s'] / queued * 1000.0 if queued else 0.0,
+            'estimated_service_ms': self._service_time_s * 1000.0 if self._service_time_s is not None else None
+        }
+
+
+def limiter_from_env(route_class: str, max_concurrent: int, max_queue: int, max_wait_ms: float = 2000) -> AdmissionLimiter:
+    """Build a limiter from ADMISSION_<CLASS>_{CONCURRENCY,QUEUE,MAX_WAIT_MS}"""
+    prefix = f"ADMISSION_{route_class.upper()}"
+    return AdmissionLimiter(
+        route_class,
+        max_concurrent=int(os.getenv(f"{prefix}_CONCURRENCY", str(max_concurrent))),
+        max_queue=int(os.getenv(f"{prefix}_QUEUE", str(max_queue))),
+        max_wait_s=float(os.getenv(f"{prefix}_MAX_WAIT_MS", str(max_wait_ms))) / 1000.0
+    )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying a limiter per route class.
+
+    The slot is held until the response body has been fully sent, so
+    streaming responses count against their class for their whole lifetime.
+    Paths without a limiter (health checks, categories) bypass admission
+    entirely and stay fast under overload.
+    """
+
+    DEADLINE_HEADER = b"x-request-timeout-ms"
+
+    def __init__(self, app, limiters: Dict[str, AdmissionLimiter]):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http" and scope.get("method") != "OPTIONS":
+            limiter = self.limiters.get(scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        deadline_s = None
+        for name, value in scope.get("headers", []):
+            if name == self.DEADLINE_HEADER:
+                try:
+                    deadline_s = float(value) / 1000.0
+                except ValueError:
+                    pass
+
+        try:
+            with span("admission_wait", route_class=limiter.name):
+                await limiter.acquire(deadline_s)
+        except AdmissionRejected as e:
+            logger.warning(str(e))
+            await self._send_rejection(send, e)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    async def _send_rejection(self, send, rejection: AdmissionRejected):
+        body = json.dumps({
+            "detail": f"Server busy ({rejection.reason}), please retry",
+            "retry_after": math.ceil(rejection.retry_after_s)
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(rejection.retry_after_s)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
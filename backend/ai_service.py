@@ -1,4 +1,7 @@
 import os
+import time
+import random
+import asyncio
 from typing import List, Dict, Any, Optional, AsyncGenerator
 import openai
 import anthropic
@@ -7,12 +10,16 @@ import json
 import logging
 from enum import Enum
 
+from provider_router import ProviderRouter, ProviderUnavailableError
+from profiling import span
+
 logger = logging.getLogger(__name__)
 
 class AIProvider(Enum):
     OPENAI = "openai"
     ANTHROPIC = "anthropic"
     LOCAL = "local"  # For future Ollama integration
+    STUB = "stub"  # Local stand-in for testing routing and hedging
 
 @dataclass
 class ChatMessage:
@@ -20,29 +27,188 @@ class ChatMessage:
     content: str
     name: Optional[str] = None
 
-class AIService:
-    def __init__(self, provider: AIProvider = AIProvider.OPENAI):
-        self.provider = provider
-        self._setup_client()
+def _to_provider_messages(messages: List[ChatMessage]) -> List[Dict[str, str]]:
+    """Convert messages to provider format, skipping system messages as we handle them separately"""
+    return [
+        {"role": msg.role, "content": msg.content}
+        for msg in messages
+        if msg.role != "system"
+    ]
+
+class ProviderBackend:
+    """A single chat completion provider that can stream a response"""
+    
+    provider: AIProvider
+    
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+    
+    async def stream(self,
+                     messages: List[ChatMessage],
+                     system_prompt: str,
+                     temperature: float,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        raise NotImplementedError
+        yield
+
+class OpenAIBackend(ProviderBackend):
+    provider = AIProvider.OPENAI
+    
+    def __init__(self, name: str = "openai"):
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable not set")
+        super().__init__(name, os.getenv("OPENAI_MODEL", "gpt-4-turbo-preview"))
+        self.client = openai.AsyncOpenAI(api_key=api_key)
+    
+    async def stream(self,
+                     messages: List[ChatMessage],
+                     system_prompt: str,
+                     temperature: float,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        """Stream response using OpenAI"""
+        
+        openai_messages = [{"role": "system", "content": system_prompt}] + _to_provider_messages(messages)
+        
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=openai_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the HTTP stream stops generation upstream
+            await stream.close()
+
+class AnthropicBackend(ProviderBackend):
+    provider = AIProvider.ANTHROPIC
     
-    def _setup_client(self):
-        """Setup AI client based on provider"""
-        if self.provider == AIProvider.OPENAI:
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY environment variable not set")
-            self.client = openai.OpenAI(api_key=api_key)
-            self.model = "gpt-4-turbo-preview"
-            
-        elif self.provider == AIProvider.ANTHROPIC:
-            api_key = os.getenv("ANTHROPIC_API_KEY")
-            if not api_key:
-                raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-            self.client = anthropic.Anthropic(api_key=api_key)
-            self.model = "claude-3-sonnet-20240229"
-            
-        else:
-            raise ValueError(f"Provider {self.provider} not implemented yet")
+    def __init__(self, name: str = "anthropic"):
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+        super().__init__(name, os.getenv("ANTHROPIC_MODEL", "claude-3-sonnet-20240229"))
+        self.client = anthropic.AsyncAnthropic(api_key=api_key)
+    
+    async def stream(self,
+                     messages: List[ChatMessage],
+                     system_prompt: str,
+                     temperature: float,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        """Stream response using Anthropic"""
+        
+        async with self.client.messages.stream(
+            model=self.model,
+            system=system_prompt,
+            messages=_to_provider_messages(messages),
+            temperature=temperature,
+            max_tokens=max_tokens
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+class StubBackend(ProviderBackend):
+    """Local provider with configurable latency and failures, for testing without API keys"""
+    
+    provider = AIProvider.STUB
+    
+    def __init__(self,
+                 name: str = "stub",
+                 first_token_ms: float = 50.0,
+                 token_ms: float = 10.0,
+                 failure_rate: float = 0.0,
+                 response: str = "This is a stub response from the local test provider."):
+        super().__init__(name, "stub")
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.failure_rate = failure_rate
+        self.response = response
+        self.tokens_streamed = 0
+    
+    @classmethod
+    def from_env(cls, name: str = "stub") -> "StubBackend":
+        return cls(
+            name=name,
+            first_token_ms=float(os.getenv("STUB_FIRST_TOKEN_MS", "50")),
+            token_ms=float(os.getenv("STUB_TOKEN_MS", "10")),
+            failure_rate=float(os.getenv("STUB_FAILURE_RATE", "0"))
+        )
+    
+    async def stream(self,
+                     messages: List[ChatMessage],
+                     system_prompt: str,
+                     temperature: float,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        """Stream the canned response word by word"""
+        await asyncio.sleep(self.first_token_ms / 1000.0)
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"Stub provider {self.name} failed")
+        
+        for i, word in enumerate(self.response.split()[:max_tokens]):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000.0)
+            self.tokens_streamed += 1
+            yield word + " "
+
+def create_backend(provider: AIProvider, name: Optional[str] = None) -> ProviderBackend:
+    """Create the backend for a provider"""
+    name = name or provider.value
+    if provider == AIProvider.OPENAI:
+        return OpenAIBackend(name)
+    elif provider == AIProvider.ANTHROPIC:
+        return AnthropicBackend(name)
+    elif provider == AIProvider.STUB:
+        return StubBackend.from_env(name)
+    else:
+        raise ValueError(f"Provider {provider} not implemented yet")
+
+def configured_providers_from_env() -> List[AIProvider]:
+    """Providers in priority order from AI_PROVIDERS, or from the API keys that are set"""
+    configured = os.getenv("AI_PROVIDERS")
+    if configured:
+        return [AIProvider(name.strip().lower()) for name in configured.split(",") if name.strip()]
+    
+    providers = []
+    if os.getenv("ANTHROPIC_API_KEY"):
+        providers.append(AIProvider.ANTHROPIC)
+    if os.getenv("OPENAI_API_KEY"):
+        providers.append(AIProvider.OPENAI)
+    return providers
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+class AIService:
+    def __init__(self,
+                 provider: AIProvider = AIProvider.OPENAI,
+                 providers: Optional[List[AIProvider]] = None,
+                 backends: Optional[List[ProviderBackend]] = None):
+        if backends is None:
+            backends = []
+            for p in providers or [provider]:
+                # Give repeated providers (e.g. two stubs) distinct names
+                count = sum(1 for backend in backends if backend.provider == p)
+                backends.append(create_backend(p, p.value if count == 0 else f"{p.value}-{count + 1}"))
+        
+        self.backends = backends
+        self.provider = backends[0].provider
+        self.model = backends[0].model
+        self.router = ProviderRouter(
+            backends,
+            hedge_enabled=_env_flag("HEDGE_ENABLED", "true"),
+            hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            min_hedge_delay_ms=float(os.getenv("HEDGE_MIN_DELAY_MS", "50")),
+            default_hedge_delay_ms=float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "2000")),
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3")),
+            cooldown_s=float(os.getenv("CIRCUIT_COOLDOWN_S", "30"))
+        )
     
     def create_system_prompt(self, 
                            mode: str, 
@@ -119,143 +285,45 @@ class AIService:
                               system_prompt: str,
                               temperature: float = 0.7,
                               max_tokens: int = 1000) -> str:
-        """Generate AI response"""
+        """Generate AI response.
         
-        try:
-            if self.provider == AIProvider.OPENAI:
-                return await self._openai_generate(messages, system_prompt, temperature, max_tokens)
-            elif self.provider == AIProvider.ANTHROPIC:
-                return await self._anthropic_generate(messages, system_prompt, temperature, max_tokens)
-            else:
-                raise ValueError(f"Provider {self.provider} not supported")
-                
-        except Exception as e:
-            logger.error(f"Error generating AI response: {e}")
-            return f"I apologize, but I'm experiencing technical difficulties right now. Please try again in a moment. Error: {str(e)}"
-    
-    async def _openai_generate(self,
-                             messages: List[ChatMessage],
-                             system_prompt: str,
-                             temperature: float,
-                             max_tokens: int) -> str:
-        """Generate response using OpenAI"""
-        
-        # Convert messages to OpenAI format
-        openai_messages = [{"role": "system", "content": system_prompt}]
-        
-        for msg in messages:
-            if msg.role != "system":  # Skip system messages as we handle them separately
-                openai_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        response = await self.client.chat.completions.acreate(
-            model=self.model,
-            messages=openai_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        
-        return response.choices[0].message.content
-    
-    async def _anthropic_generate(self,
-                                messages: List[ChatMessage],
-                                system_prompt: str,
-                                temperature: float,
-                                max_tokens: int) -> str:
-        """Generate response using Anthropic Claude"""
-        
-        # Convert messages to Anthropic format
-        claude_messages = []
-        
-        for msg in messages:
-            if msg.role != "system":
-                claude_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        response = await self.client.messages.acreate(
-            model=self.model,
-            system=system_prompt,
-            messages=claude_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        
-        return response.content[0].text
+        Raises ProviderUnavailableError when every provider failed or is
+        circuit-broken, so callers can report a proper error status.
+        """
+        chunks = []
+        async for chunk in self.stream_response(messages, system_prompt, temperature, max_tokens):
+            chunks.append(chunk)
+        return "".join(chunks)
     
     async def stream_response(self,
                             messages: List[ChatMessage],
                             system_prompt: str,
                             temperature: float = 0.7,
                             max_tokens: int = 1000) -> AsyncGenerator[str, None]:
-        """Stream AI response for real-time updates"""
+        """Stream AI response for real-time updates, hedged across providers"""
+        
+        def call(backend: ProviderBackend) -> AsyncGenerator[str, None]:
+            return backend.stream(messages, system_prompt, temperature, max_tokens)
         
         try:
-            if self.provider == AIProvider.OPENAI:
-                async for chunk in self._openai_stream(messages, system_prompt, temperature, max_tokens):
-                    yield chunk
-            elif self.provider == AIProvider.ANTHROPIC:
-                async for chunk in self._anthropic_stream(messages, system_prompt, temperature, max_tokens):
-                    yield chunk
-            else:
-                yield "Streaming not supported for this provider"
-                
-        except Exception as e:
+            with span("provider_call") as call_span:
+                started = time.perf_counter()
+                chunks = 0
+                stream = self.router.stream(call)
+                try:
+                    async for chunk in stream:
+                        if chunks == 0:
+                            call_span.set(first_token_ms=round((time.perf_counter() - started) * 1000.0, 3))
+                        chunks += 1
+                        yield chunk
+                finally:
+                    # Close the provider stream now, also when our consumer stopped mid-answer
+                    await stream.aclose()
+                call_span.set(chunks=chunks)
+        except ProviderUnavailableError as e:
             logger.error(f"Error streaming AI response: {e}")
-            yield f"Error: {str(e)}"
+            raise
     
-    async def _openai_stream(self,
-                           messages: List[ChatMessage],
-                           system_prompt: str,
-                           temperature: float,
-                           max_tokens: int) -> AsyncGenerator[str, None]:
-        """Stream response using OpenAI"""
-        
-        openai_messages = [{"role": "system", "content": system_prompt}]
-        
-        for msg in messages:
-            if msg.role != "system":
-                openai_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        stream = await self.client.chat.completions.acreate(
-            model=self.model,
-            messages=openai_messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=True
-        )
-        
-        async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-    
-    async def _anthropic_stream(self,
-                              messages: List[ChatMessage],
-                              system_prompt: str,
-                              temperature: float,
-                              max_tokens: int) -> AsyncGenerator[str, None]:
-        """Stream response using Anthropic"""
-        
-        claude_messages = []
-        for msg in messages:
-            if msg.role != "system":
-                claude_messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        async with self.client.messages.stream(
-            model=self.model,
-            system=system_prompt,
-            messages=claude_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        ) as stream:
-            async for text in stream.text_stream:
-                yield text
+    def get_stats(self) -> Dict[str, Any]:
+        """Provider routing metrics"""
+        return self.router.get_stats()
@@ -0,0 +1,135 @@
+import time
+import logging
+import functools
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+import anyio
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# The cancellation of the request being served; inherited by worker threads
+_current_cancellation: ContextVar[Optional["Cancellation"]] = ContextVar("current_cancellation", default=None)
+
+
+class RequestCancelled(Exception):
+    """Raised by check_cancelled() once the client has gone away"""
+
+
+class Cancellation:
+    """Thread-safe flag set when a client disconnects"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+        self.cancelled_at: Optional[float] = None
+
+    def cancel(self, reason: str):
+        if not self._event.is_set():
+            self.reason = reason
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+def check_cancelled():
+    """Stop blocking work between stages when the request it serves was cancelled"""
+    cancellation = _current_cancellation.get()
+    if cancellation is not None and cancellation.cancelled:
+        raise RequestCancelled(cancellation.reason)
+
+
+async def run_cancellable(func, *args):
+    """Like run_in_threadpool, but a cancelled caller stops waiting at once.
+
+    The thread itself runs on until its next check_cancelled().
+    """
+    return await anyio.to_thread.run_sync(functools.partial(func, *args), cancellable=True)
+
+
+class StreamCancellationStats:
+    """Completed vs abandoned streams and the generation they did not spend"""
+
+    def __init__(self):
+        self.metrics = {
+            'completed': 0, 'cancelled': 0,
+            'cancelled_in_retrieval': 0, 'cancelled_in_generation': 0,
+            'tokens_generated_before_cancel': 0, 'tokens_saved_estimate': 0
+        }
+        self._completed_tokens = 0
+        self._cleanup_ms_total = 0.0
+        self._cleanups = 0
+
+    def record_completed(self, tokens: int):
+        self.metrics['completed'] += 1
+        self._completed_tokens += tokens
+
+    def record_cancelled(self, stage: str, tokens_generated: int, max_tokens: Optional[int]) -> int:
+        """Count an abandoned stream; max_tokens is None when no provider would have been called.
+
+        Tokens saved are estimated from the mean length of completed answers,
+        capped at the request's max_tokens.
+        """
+        self.metrics['cancelled'] += 1
+        self.metrics[f'cancelled_in_{stage}'] += 1
+        self.metrics['tokens_generated_before_cancel'] += tokens_generated
+        if max_tokens is None:
+            return 0
+        expected = self._completed_tokens / self.metrics['completed'] if self.metrics['completed'] else max_tokens
+        saved = max(0, int(min(expected, max_tokens)) - tokens_generated)
+        self.metrics['tokens_saved_estimate'] += saved
+        return saved
+
+    def record_cleanup(self, cleanup_ms: float):
+        self._cleanup_ms_total += cleanup_ms
+        self._cleanups += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        finished = self.metrics['completed'] + self.metrics['cancelled']
+        return {
+            **self.metrics,
+            'cancel_rate': self.metrics['cancelled'] / finished if finished else 0.0,
+            'mean_cleanup_ms': self._cleanup_ms_total / self._cleanups if self._cleanups else None
+        }
+
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """StreamingResponse that cancels its request's work when the client disconnects.
+
+    The disconnect sets the Cancellation (seen by worker threads through
+    check_cancelled()) as soon as it arrives, and the body iterator is
+    always closed when the response ends, so provider streams suspended
+    mid-answer are shut at once instead of whenever they are collected.
+    """
+
+    def __init__(self, content, cancellation: Optional[Cancellation] = None, stats: Optional[StreamCancellationStats] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cancellation = cancellation
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        async def watched_receive():
+            message = await receive()
+            if message["type"] == "http.disconnect" and self.cancellation is not None:
+                self.cancellation.cancel("client disconnected")
+            return message
+
+        token = _current_cancellation.set(self.cancellation) if self.cancellation is not None else None
+        try:
+            await super().__call__(scope, watched_receive, send)
+        finally:
+            try:
+                close = getattr(self.body_iterator, "aclose", None)
+                if close is not None:
+                    await close()
+            except Exception as e:
+                logger.warning(f"Error closing cancelled stream: {e}")
+            if token is not None:
+                _current_cancellation.reset(token)
+            if self.stats is not None and self.cancellation is not None and self.cancellation.cancelled_at is not None:
+                self.stats.record_cleanup((time.perf_counter() - self.cancellation.cancelled_at) * 1000.0)
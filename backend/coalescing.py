@@ -0,0 +1,110 @@
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Callable, Awaitable, AsyncGenerator
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(**fields: Any) -> str:
+    """Canonical hash of request fields: key order and whitespace never matter"""
+    canonical = json.dumps(fields, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """One in-flight upstream call shared by every request with the same key"""
+
+    def __init__(self):
+        self.task: asyncio.Task = None
+        self.waiters = 0
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: BaseException = None
+        self.updated = asyncio.Event()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one upstream call.
+
+    `do` shares a single awaited result; `stream` fans the same chunk stream
+    out to every subscriber, replaying chunks a late joiner missed. The
+    upstream call is cancelled only when every waiter has gone away.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+        self.metrics = {'leaders': 0, 'coalesced': 0, 'upstream_cancelled': 0}
+
+    def _join(self, key: str, start: Callable[[_Flight], asyncio.Task]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = start(flight)
+            flight.task.add_done_callback(lambda task: self._finish(key, flight, task))
+            self.metrics['leaders'] += 1
+        else:
+            self.metrics['coalesced'] += 1
+        flight.waiters += 1
+        return flight
+
+    def _finish(self, key: str, flight: _Flight, task: asyncio.Task):
+        # Later identical requests start a fresh call rather than reuse a stale result
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Errors are delivered to the waiters; mark them retrieved for asyncio
+        if not task.cancelled():
+            task.exception()
+
+    def _leave(self, flight: _Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            self.metrics['upstream_cancelled'] += 1
+            flight.task.cancel()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() once for all concurrent callers with the same key"""
+        flight = self._join(key, lambda _: asyncio.ensure_future(fn()))
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    async def stream(self, key: str, fn: Callable[[], AsyncGenerator[Any, None]]) -> AsyncGenerator[Any, None]:
+        """Iterate fn() once and fan its chunks out to all concurrent subscribers"""
+
+        async def produce(flight: _Flight):
+            try:
+                async for chunk in fn():
+                    flight.chunks.append(chunk)
+                    flight.updated.set()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                flight.done = True
+                flight.updated.set()
+
+        flight = self._join(key, lambda flight: asyncio.ensure_future(produce(flight)))
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    yield chunk
+                elif flight.done:
+                    if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+                        raise flight.error
+                    return
+                else:
+                    flight.updated.clear()
+                    await flight.updated.wait()
+        finally:
+            self._leave(flight)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.metrics, 'in_flight': len(self._flights)}
@@ -0,0 +1,98 @@
+import re
+import zlib
+from typing import List, Dict, Tuple, Optional, Hashable
+
+import numpy as np
+
+# Mersenne prime for the universal hash family behind the MinHash permutations
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+def shingles(text: str, size: int = 3) -> frozenset:
+    """Hashed word n-grams of a text, ignoring case, punctuation and markdown markup"""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < size:
+        return frozenset([zlib.crc32(" ".join(words).encode('utf-8'))])
+    return frozenset(zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_bands(threshold: float, num_perm: int, min_recall: float = 0.99) -> Tuple[int, int]:
+    """(bands, rows) with the fewest candidate pairs that still catch a pair at
+    the threshold with probability min_recall"""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1.0 - (1.0 - threshold ** rows) ** bands >= min_recall:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateDetector:
+    """Streaming near-duplicate detection with MinHash and LSH banding.
+
+    Each text is reduced to a MinHash signature of its word shingles; LSH
+    buckets on signature bands find candidate matches among the canonical
+    texts seen so far, which are then confirmed by exact shingle Jaccard
+    similarity. Texts only match within the same group.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("Similarity threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets: Dict[Tuple[Hashable, int, bytes], List[Hashable]] = {}
+        self._shingles: Dict[Hashable, frozenset] = {}
+        self.metrics = {'texts': 0, 'duplicates': 0, 'candidates_checked': 0}
+
+    def signature(self, text_shingles: frozenset) -> np.ndarray:
+        values = np.fromiter(text_shingles, dtype=np.uint64, count=len(text_shingles))
+        # Products of two 32-bit values fit in 64 bits, so nothing wraps before the modulus
+        return ((np.outer(values, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    def add(self, key: Hashable, text: str, group: Hashable = None) -> Optional[Tuple[Hashable, float]]:
+        """Match a text against earlier canonical texts in its group.
+
+        Returns (canonical key, similarity) for a near-duplicate; otherwise
+        the text becomes canonical under key and None is returned.
+        """
+        self.metrics['texts'] += 1
+        text_shingles = shingles(text, self.shingle_size)
+        signature = self.signature(text_shingles)
+        band_keys = [
+            (group, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+        best = None
+        seen = set()
+        for band_key in band_keys:
+            for candidate in self._buckets.get(band_key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                self.metrics['candidates_checked'] += 1
+                similarity = jaccard(text_shingles, self._shingles[candidate])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+
+        if best is not None:
+            self.metrics['duplicates'] += 1
+            return best
+
+        self._shingles[key] = text_shingles
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
@@ -0,0 +1,170 @@
+import zlib
+import time
+import logging
+import threading
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional
+
+import httpx
+import numpy as np
+
+from metadata_index import SearchFilters
+from shards import merge_top_k
+
+logger = logging.getLogger(__name__)
+
+
+def partition_of(item_id: str, shard_count: int) -> int:
+    """Stable shard assignment for an item ID (same on every process)"""
+    return zlib.crc32(item_id.encode('utf-8')) % shard_count
+
+
+class ScatterGatherClient:
+    """Fan encoded queries out to shard nodes and merge their top-k.
+
+    Every shard is queried concurrently. Shards that fail or miss the
+    deadline are left out and the result is flagged partial rather than
+    failing the whole search.
+    """
+
+    SEARCH_PATH = "/api/shard/search"
+    FACETS_PATH = "/api/knowledge/facets"
+    # How soon facets are refetched after a fetch missed some shards
+    FACETS_RETRY_S = 5.0
+
+    def __init__(self,
+                 shard_urls: List[str],
+                 deadline_s: float = 0.5,
+                 facets_ttl_s: float = 60.0,
+                 encoder: Optional[Dict[str, Any]] = None):
+        if not shard_urls:
+            raise ValueError("At least one shard URL is required")
+
+        self.shard_urls = [url.rstrip('/') for url in shard_urls]
+        self.deadline_s = deadline_s
+        self.facets_ttl_s = facets_ttl_s
+        # Signature of the coordinator's encoder; shards built with another one refuse the query
+        self.encoder = encoder
+        self.client = httpx.Client(timeout=deadline_s, limits=httpx.Limits(max_connections=64))
+        self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.shard_urls) * 4), thread_name_prefix="scatter")
+        self._facets: Optional[Dict[str, Any]] = None
+        self._facets_fetched_at = 0.0
+        self._facets_lock = threading.Lock()
+        self._facets_valid_s = facets_ttl_s
+        self._facets_refreshing = False
+        self.metrics = {'searches': 0, 'partial': 0, 'shard_timeouts': 0, 'shard_errors': 0}
+        self.shard_latency_ms: Dict[str, float] = {}
+        # Start the first facet fetch now so counts are ready by the first request
+        self.facets()
+
+    def _search_shard(self, url: str, payload: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+        started = time.perf_counter()
+        response = self.client.post(url + self.SEARCH_PATH, json=payload)
+        response.raise_for_status()
+        self.shard_latency_ms[url] = (time.perf_counter() - started) * 1000.0
+        return response.json()['results']
+
+    def search(self,
+               query_embeddings: np.ndarray,
+               top_k: int,
+               filters: Optional[SearchFilters] = None,
+               search_info: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Scatter to all shards, gather within the deadline and merge by score"""
+        self.metrics['searches'] += 1
+        payload = {
+            'embeddings': query_embeddings.tolist(),
+            'top_k': top_k,
+            'filters': asdict(filters) if filters is not None else None,
+            'encoder': self.encoder
+        }
+
+        futures = {self.executor.submit(self._search_shard, url, payload): url for url in self.shard_urls}
+        done, not_done = wait(futures, timeout=self.deadline_s)
+
+        failed_shards = []
+        per_shard = []
+        for future in done:
+            try:
+                per_shard.append(future.result())
+            except Exception as e:
+                self.metrics['shard_errors'] += 1
+                failed_shards.append(futures[future])
+                logger.warning(f"Shard {futures[future]} failed: {e}")
+        for future in not_done:
+            # The HTTP timeout bounds how long the abandoned request lingers
+            future.cancel()
+            self.metrics['shard_timeouts'] += 1
+            failed_shards.append(futures[future])
+            logger.warning(f"Shard {futures[future]} missed the {self.deadline_s * 1000:.0f}ms deadline")
+
+        if failed_shards:
+            self.metrics['partial'] += 1
+        if search_info is not None:
+            search_info['partial'] = bool(failed_shards)
+            search_info['failed_shards'] = failed_shards
+
+        return [
+            merge_top_k([shard_results[row] for shard_results in per_shard], top_k)
+            for row in range(len(query_embeddings))
+        ]
+
+    def _fetch_shard_facets(self, url: str) -> Dict[str, Any]:
+        response = self.client.get(url + self.FACETS_PATH)
+        response.raise_for_status()
+        return response.json()
+
+    def _refresh_facets(self):
+        """Fetch facet counts from every shard concurrently (on a background thread)"""
+        try:
+            futures = {self.executor.submit(self._fetch_shard_facets, url): url for url in self.shard_urls}
+            totals = {'categories': {}, 'tags': {}, 'sources': {}, 'total_items': 0}
+            failed_shards = []
+            for future, url in futures.items():
+                try:
+                    shard_facets = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not fetch facets from shard {url}: {e}")
+                    failed_shards.append(url)
+                    continue
+                for facet in ('categories', 'tags', 'sources'):
+                    for value, count in shard_facets[facet].items():
+                        totals[facet][value] = totals[facet].get(value, 0) + count
+                totals['total_items'] += shard_facets['total_items']
+            totals['partial'] = bool(failed_shards)
+            totals['failed_shards'] = failed_shards
+
+            with self._facets_lock:
+                self._facets = totals
+                self._facets_fetched_at = time.monotonic()
+                # Incomplete counts are retried soon rather than served for the full TTL
+                self._facets_valid_s = self.FACETS_RETRY_S if failed_shards else self.facets_ttl_s
+        finally:
+            with self._facets_lock:
+                self._facets_refreshing = False
+
+    def facets(self) -> Dict[str, Any]:
+        """Summed facet counts across shards.
+
+        Never blocks on the network: returns the last snapshot (empty and
+        partial before the first fetch completes) and refreshes it on a
+        background thread once it is older than its TTL.
+        """
+        with self._facets_lock:
+            stale = self._facets is None or time.monotonic() - self._facets_fetched_at >= self._facets_valid_s
+            if stale and not self._facets_refreshing:
+                self._facets_refreshing = True
+                threading.Thread(target=self._refresh_facets, name="scatter-facets", daemon=True).start()
+            if self._facets is None:
+                return {'categories': {}, 'tags': {}, 'sources': {}, 'total_items': 0, 'partial': True, 'failed_shards': []}
+            return self._facets
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            'shard_urls': self.shard_urls,
+            'deadline_ms': self.deadline_s * 1000.0,
+            'last_shard_latency_ms': dict(self.shard_latency_ms),
+            'facets_partial': self._facets['partial'] if self._facets is not None else None,
+            'facets_failed_shards': list(self._facets['failed_shards']) if self._facets is not None else []
+        }
@@ -0,0 +1,128 @@
+"""Export the embedding model to ONNX and check encoder backends agree.
+
+    python encoder_tools.py export --output models/minilm-onnx
+    python encoder_tools.py parity --kb knowledge_base --candidate onnx --onnx-path models/minilm-onnx
+
+export writes model.onnx, an int8 dynamically quantized model_quantized.onnx
+and tokenizer.json (needs torch, transformers and requirements-onnx.txt,
+at export time only). parity encodes a knowledge base's items and sample
+queries with two backends and compares the rankings they produce; it
+exits non-zero when mean overlap@k falls below --min-overlap.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from encoders import ENCODER_BACKENDS, Encoder, create_encoder
+
+
+def export_onnx(model_name: str, output_dir: str, opset: int = 14):
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name).eval()
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(output / "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+    quantize_dynamic(str(output / "model.onnx"), str(output / "model_quantized.onnx"), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(str(output))
+    print(f"Exported {hub_name} to {output} (model.onnx, model_quantized.onnx, tokenizer.json)")
+
+
+def normalized(embeddings: np.ndarray) -> np.ndarray:
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype('float32')
+
+
+def timed_encode(encoder: Encoder, texts: List[str]):
+    started = time.perf_counter()
+    embeddings = normalized(encoder.encode(texts))
+    return embeddings, (time.perf_counter() - started) * 1000.0 / len(texts)
+
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def parity(args) -> bool:
+    with open(f"{args.kb}.json", 'r', encoding='utf-8') as f:
+        items = json.load(f)['knowledge_items']
+    texts = [f"{item['title']}\n\n{item['content']}" for item in items]
+    queries = [item['title'] for item in random.Random(0).sample(items, min(args.num_queries, len(items)))]
+
+    reference = create_encoder(args.reference, args.model, args.onnx_path)
+    candidate = create_encoder(args.candidate, args.model, args.onnx_path)
+    print(f"reference {reference.signature()}\ncandidate {candidate.signature()}")
+
+    reference_corpus, reference_ms = timed_encode(reference, texts)
+    candidate_corpus, candidate_ms = timed_encode(candidate, texts)
+    reference_queries, _ = timed_encode(reference, queries)
+    candidate_queries, _ = timed_encode(candidate, queries)
+    print(f"{len(texts)} items, {len(queries)} queries: {reference_ms:.2f} ms/text reference, "
+          f"{candidate_ms:.2f} ms/text candidate ({reference_ms / candidate_ms:.2f}x)")
+
+    if reference_corpus.shape[1] == candidate_corpus.shape[1]:
+        cosine = np.sum(reference_corpus * candidate_corpus, axis=1)
+        print(f"item embedding cosine: mean {cosine.mean():.4f}   min {cosine.min():.4f}")
+
+    # Each backend ranks against its own corpus embeddings, as it would when serving
+    k = min(args.k, len(texts))
+    expected = top_k(reference_corpus, reference_queries, k)
+    actual = top_k(candidate_corpus, candidate_queries, k)
+    overlaps = np.array([len(set(a) & set(b)) / k for a, b in zip(expected, actual)])
+    top1 = np.mean(expected[:, 0] == actual[:, 0])
+    print(f"overlap@{k}: mean {overlaps.mean():.3f}   min {overlaps.min():.3f}   top-1 agreement {top1:.3f}")
+
+    passed = overlaps.mean() >= args.min_overlap
+    print("PASS" if passed else f"FAIL: mean overlap@{k} below {args.min_overlap}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding encoder backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the model to (int8 quantized) ONNX")
+    export.add_argument("--model", default="all-MiniLM-L6-v2")
+    export.add_argument("--output", required=True, help="Directory for the ONNX model and tokenizer")
+
+    check = commands.add_parser("parity", help="Compare rankings from two encoder backends")
+    check.add_argument("--kb", required=True, help="Knowledge base path prefix (texts are re-encoded)")
+    check.add_argument("--reference", default="sentence-transformers", choices=ENCODER_BACKENDS)
+    check.add_argument("--candidate", default="onnx", choices=ENCODER_BACKENDS)
+    check.add_argument("--model", default="all-MiniLM-L6-v2")
+    check.add_argument("--onnx-path", help="Directory written by export")
+    check.add_argument("--k", type=int, default=10)
+    check.add_argument("--num-queries", type=int, default=200)
+    check.add_argument("--min-overlap", type=float, default=0.9)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(args.model, args.output)
+    elif not parity(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
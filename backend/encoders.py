@@ -0,0 +1,188 @@
+import os
+import re
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('sentence-transformers', 'onnx', 'hashing')
+
+# Written by encoder_tools.py export; the unquantized model is the fallback
+ONNX_MODEL_FILES = ('model_quantized.onnx', 'model.onnx')
+
+
+class Encoder:
+    """Turns texts into embedding rows for the knowledge base and queries.
+
+    Embeddings from different backends (or models) live in different
+    spaces, so a knowledge base records the signature of the encoder that
+    built it and is only searched with a matching one.
+    """
+
+    backend = ""
+
+    def __init__(self, model_name: str, dimension: int):
+        self.model_name = model_name
+        self.dimension = dimension
+
+    def encode(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        raise NotImplementedError
+
+    def signature(self) -> Dict[str, Any]:
+        return {'backend': self.backend, 'model': self.model_name, 'dimension': self.dimension}
+
+
+class SentenceTransformerEncoder(Encoder):
+    """The reference PyTorch sentence-transformers model"""
+
+    backend = "sentence-transformers"
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        super().__init__(model_name, self.model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, show_progress_bar=show_progress), dtype='float32')
+
+
+class OnnxEncoder(Encoder):
+    """An ONNX Runtime export of the same model on CPU, int8-quantized when available.
+
+    Loads model_quantized.onnx (else model.onnx) and tokenizer.json from a
+    local directory, as written by encoder_tools.py export, and mean-pools
+    token embeddings like the sentence-transformers model does. Needs only
+    onnxruntime and tokenizers (requirements-onnx.txt), not PyTorch.
+    """
+
+    backend = "onnx"
+
+    def __init__(self,
+                 model_path: str,
+                 model_name: str = "all-MiniLM-L6-v2",
+                 batch_size: int = 32,
+                 max_length: int = 256,
+                 threads: int = 0):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(f"The onnx encoder backend needs onnxruntime and tokenizers: pip install -r requirements-onnx.txt ({e})") from e
+
+        directory = Path(model_path)
+        model_file = next((directory / name for name in ONNX_MODEL_FILES if (directory / name).exists()), None)
+        if model_file is None:
+            raise FileNotFoundError(f"No ONNX model in {directory}; run encoder_tools.py export first")
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.quantized = model_file.name == ONNX_MODEL_FILES[0]
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(str(directory / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+
+        super().__init__(model_name, 0)
+        self.dimension = int(self.encode(["dimension probe"]).shape[1])
+        logger.info(f"Loaded ONNX encoder {model_file} ({'int8' if self.quantized else 'fp32'}, {self.dimension} dimensions)")
+
+    def encode(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + self.batch_size]))
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype='int64')
+            feeds = {
+                'input_ids': np.array([encoding.ids for encoding in encodings], dtype='int64'),
+                'attention_mask': attention_mask
+            }
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.array([encoding.type_ids for encoding in encodings], dtype='int64')
+
+            token_embeddings = self.session.run(None, feeds)[0]
+            # Mean pooling over real (unpadded) tokens
+            mask = attention_mask[:, :, None].astype('float32')
+            batches.append((token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+            if show_progress:
+                logger.info(f"Encoded {min(start + self.batch_size, len(texts))}/{len(texts)} texts")
+
+        return np.vstack(batches).astype('float32')
+
+    def signature(self) -> Dict[str, Any]:
+        return {**super().signature(), 'quantized': self.quantized}
+
+
+class HashingEncoder(Encoder):
+    """Deterministic feature hashing of word unigrams and bigrams.
+
+    No model download and identical output on every machine, for offline
+    tests and benchmarks. Captures word overlap only, not meaning.
+    """
+
+    backend = "hashing"
+
+    def __init__(self, dimension: int = 384, seed: int = 0):
+        super().__init__(f"hashing-seed{seed}", dimension)
+        self.seed = seed
+
+    def encode(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            tokens = re.findall(r'\w+', text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                digest = hashlib.blake2b(f"{self.seed}:{feature}".encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                embeddings[row, value % self.dimension] += 1.0 if value >> 63 else -1.0
+            if not embeddings[row].any():
+                # Keep empty texts normalizable
+                embeddings[row, 0] = 1.0
+        return embeddings
+
+
+def create_encoder(backend: str = "sentence-transformers",
+                   model_name: str = "all-MiniLM-L6-v2",
+                   onnx_path: Optional[str] = None,
+                   dimension: int = 384) -> Encoder:
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_name)
+    if backend == "onnx":
+        if not onnx_path:
+            raise ValueError("The onnx encoder backend needs ENCODER_ONNX_PATH (a directory from encoder_tools.py export)")
+        return OnnxEncoder(onnx_path, model_name, threads=int(os.getenv("ENCODER_THREADS", "0")))
+    if backend == "hashing":
+        return HashingEncoder(dimension)
+    raise ValueError(f"Unknown encoder backend: {backend} (expected one of {', '.join(ENCODER_BACKENDS)})")
+
+
+def encoder_from_env(model_name: str = "all-MiniLM-L6-v2") -> Encoder:
+    return create_encoder(
+        os.getenv("ENCODER_BACKEND", "sentence-transformers"),
+        os.getenv("ENCODER_MODEL", model_name),
+        os.getenv("ENCODER_ONNX_PATH") or None,
+        int(os.getenv("ENCODER_HASHING_DIM", "384"))
+    )
+
+
+def check_signature(recorded: Optional[Dict[str, Any]], encoder: Encoder, source: str):
+    """Raise when a knowledge base was embedded by a different encoder"""
+    if recorded is None:
+        # Built before encoder signatures were recorded: always sentence-transformers
+        recorded = {'backend': 'sentence-transformers'}
+    current = encoder.signature()
+    mismatched = [key for key, value in recorded.items() if current.get(key) != value]
+    if mismatched:
+        raise ValueError(
+            f"{source} was embedded with encoder {recorded} but this process uses {current} "
+            f"(mismatched: {', '.join(mismatched)}); rebuild it or change ENCODER_BACKEND"
+        )
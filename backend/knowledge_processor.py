@@ -4,18 +4,36 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import markdown
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import json
 import pickle
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 import re
+import itertools
+import threading
+from collections import OrderedDict
+
+from retrieval import reciprocal_rank_fusion
+from metadata_index import MetadataIndex, SearchFilters
+from shards import ShardManager, MANIFEST_NAME, shard_file_stem
+from distributed import ScatterGatherClient, partition_of
+from projection import EmbeddingProjection
+from dedup import NearDuplicateDetector
+from profiling import span
+from encoders import Encoder, encoder_from_env, check_signature
+from query_log import normalize_query
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-wide counter so every built or loaded index gets a distinct generation
+_generation_counter = itertools.count(1)
+
+# Source prefix for items written through the API rather than read from Data/
+API_SOURCE_PREFIX = "api:"
+
 @dataclass
 class KnowledgeItem:
     id: str
@@ -25,14 +43,88 @@ class KnowledgeItem:
     category: str
     tags: List[str]
     embedding: Optional[np.ndarray] = None
+    # Other files with a near-identical section, collapsed into this item at ingest
+    duplicate_sources: List[str] = field(default_factory=list)
+
+class QueryEmbeddingCache:
+    """LRU of unit-normalized, full-dimension query embeddings by normalized query text.
+    
+    Valid for any processor using the same encoder, so it is shared by
+    compacted copies and rebuilds.
+    """
+    
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0}
+    
+    def get(self, query: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(query)
+            if vector is None:
+                self.metrics['misses'] += 1
+                return None
+            self._entries.move_to_end(query)
+            self.metrics['hits'] += 1
+            return vector
+    
+    def put(self, query: str, vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[query] = vector
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.metrics['hits'] + self.metrics['misses']
+        return {
+            **self.metrics,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hit_rate': self.metrics['hits'] / lookups if lookups else 0.0
+        }
 
 class KnowledgeProcessor:
-    def __init__(self, data_folder: str, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, data_folder: str, model_name: str = "all-MiniLM-L6-v2", encoder: Optional[Encoder] = None):
         self.data_folder = Path(data_folder)
-        self.model = SentenceTransformer(model_name)
+        # An already-loaded encoder can be shared, e.g. by a compacted copy;
+        # otherwise the backend comes from ENCODER_BACKEND
+        self.encoder = encoder if encoder is not None else encoder_from_env(model_name)
         self.knowledge_items: List[KnowledgeItem] = []
         self.index = None
         self.embeddings = None
+        # Changes whenever the searchable contents change; part of cache/coalescing keys
+        self.generation = 0
+        self.metadata_index = MetadataIndex()
+        # Unit-normalized corpus embeddings for exact search over filtered subsets
+        # (in the projected space when a projection is set)
+        self.normalized_embeddings = None
+        # Optional dimensionality reduction applied to corpus and query vectors
+        self.projection: Optional[EmbeddingProjection] = None
+        # Repeated queries skip the encoder
+        self.query_cache = QueryEmbeddingCache(int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096")))
+        # Filtered searches matching at most this many items are scored exactly
+        self.subset_search_limit = 20000
+        # Sections at least this similar (shingle Jaccard) to an earlier one in the
+        # same category are collapsed at ingest; 0 disables deduplication
+        self.dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+        self.dedup_report: Optional[Dict[str, Any]] = None
+        
+        # Online writes: the FAISS index covers the first main_count items and is
+        # never mutated in place; upserts append to a small brute-force delta
+        # segment and deletes are tombstones until compacted()
+        self.main_count = 0
+        self.delta_embeddings: Optional[np.ndarray] = None
+        self.deleted_bitmap = 0
+        self.id_to_position: Dict[str, int] = {}
+        
+        # Set by load_shards(): searches go to lazily loaded per-category shards
+        self.shards: Optional[ShardManager] = None
+        # Set by connect_shard_nodes(): searches fan out to remote shard servers
+        self.remote: Optional[ScatterGatherClient] = None
         
     def extract_content_from_markdown(self, file_path: Path) -> Dict[str, Any]:
         """Extract structured content from markdown files"""
@@ -177,10 +269,13 @@ class KnowledgeProcessor:
         """Process all markdown files in the data folder"""
         logger.info(f"Processing files in {self.data_folder}")
         
-        # Find all markdown files
-        md_files = list(self.data_folder.rglob("*.md"))
+        # Find all markdown files (sorted, so the same copy is canonical on every build)
+        md_files = sorted(self.data_folder.rglob("*.md"))
         logger.info(f"Found {len(md_files)} markdown files")
         
+        detector = NearDuplicateDetector(self.dedup_threshold) if self.dedup_threshold > 0 else None
+        duplicates: List[Dict[str, Any]] = []
+        
         for file_path in md_files:
             logger.info(f"Processing: {file_path}")
             extracted_data = self.extract_content_from_markdown(file_path)
@@ -197,6 +292,20 @@ class KnowledgeProcessor:
                         continue
                         
                     item_id = f"{file_path.stem}_{i}"
+                    if detector is not None:
+                        match = detector.add(len(self.knowledge_items), section['content'], group=extracted_data['category'])
+                        if match is not None:
+                            # Near-duplicate: fold into the canonical item instead of embedding it again
+                            canonical = self.knowledge_items[match[0]]
+                            self._merge_duplicate(canonical, extracted_data)
+                            duplicates.append({
+                                'id': item_id,
+                                'canonical_id': canonical.id,
+                                'similarity': round(match[1], 3),
+                                'chars': len(section['content'].strip())
+                            })
+                            continue
+                    
                     knowledge_item = KnowledgeItem(
                         id=item_id,
                         title=section['title'] or extracted_data['title'],
@@ -207,8 +316,52 @@ class KnowledgeProcessor:
                     )
                     self.knowledge_items.append(knowledge_item)
         
+        self.metadata_index = MetadataIndex.build(self.knowledge_items)
+        self.dedup_report = self._dedup_report(duplicates) if detector is not None else None
+        if self.dedup_report:
+            logger.info(
+                f"Deduplication: {self.dedup_report['duplicates']} of {self.dedup_report['sections']} sections were "
+                f"near-duplicates ({self.dedup_report['duplicate_ratio']:.1%}, "
+                f"{self.dedup_report['chars_skipped']} characters not embedded)"
+            )
         logger.info(f"Created {len(self.knowledge_items)} knowledge items")
     
+    @staticmethod
+    def _merge_duplicate(canonical: KnowledgeItem, extracted_data: Dict[str, Any]):
+        """Record another source of a canonical item; its tags stay filterable"""
+        source_file = extracted_data['source_file']
+        if source_file != canonical.source_file and source_file not in canonical.duplicate_sources:
+            canonical.duplicate_sources.append(source_file)
+        canonical.tags = canonical.tags + [tag for tag in extracted_data['tags'] if tag not in canonical.tags]
+    
+    def _dedup_report(self, duplicates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Summary of what deduplication collapsed, largest clusters first"""
+        sections = len(self.knowledge_items) + len(duplicates)
+        copies: Dict[str, int] = {}
+        for duplicate in duplicates:
+            copies[duplicate['canonical_id']] = copies.get(duplicate['canonical_id'], 0) + 1
+        items_by_id = {item.id: item for item in self.knowledge_items}
+        
+        largest = sorted(copies.items(), key=lambda entry: -entry[1])[:10]
+        return {
+            'threshold': self.dedup_threshold,
+            'sections': sections,
+            'items': len(self.knowledge_items),
+            'duplicates': len(duplicates),
+            'duplicate_ratio': len(duplicates) / sections if sections else 0.0,
+            'chars_skipped': sum(duplicate['chars'] for duplicate in duplicates),
+            'largest_clusters': [
+                {
+                    'id': item_id,
+                    'title': items_by_id[item_id].title,
+                    'copies': count + 1,
+                    'sources': [items_by_id[item_id].source_file] + items_by_id[item_id].duplicate_sources
+                }
+                for item_id, count in largest
+            ],
+            'collapsed': duplicates
+        }
+    
     def create_embeddings(self):
         """Create embeddings for all knowledge items"""
         logger.info("Creating embeddings...")
@@ -220,7 +373,7 @@ class KnowledgeProcessor:
             texts.append(combined_text)
         
         # Generate embeddings
-        embeddings = self.model.encode(texts, show_progress_bar=True)
+        embeddings = self.encoder.encode(texts, show_progress=True)
         
         # Store embeddings in knowledge items
         for i, embedding in enumerate(embeddings):
@@ -229,6 +382,20 @@ class KnowledgeProcessor:
         self.embeddings = embeddings
         logger.info(f"Created embeddings with shape: {embeddings.shape}")
     
+    def _search_vectors(self, embeddings: np.ndarray) -> np.ndarray:
+        """Unit-normalize (and project, if configured) vectors for the index"""
+        vectors = (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype('float32')
+        if self.projection is not None:
+            vectors = self.projection.project(vectors)
+        return vectors
+    
+    def fit_projection(self, target_dim: int, method: str = "pca"):
+        """Learn a dimensionality reduction from the corpus; call before create_faiss_index()"""
+        if self.embeddings is None:
+            raise ValueError("Embeddings not created yet. Call create_embeddings() first.")
+        normalized = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        self.projection = EmbeddingProjection.fit(normalized, target_dim, method)
+    
     def create_faiss_index(self):
         """Create FAISS index for similarity search"""
         logger.info("Creating FAISS index...")
@@ -236,47 +403,338 @@ class KnowledgeProcessor:
         if self.embeddings is None:
             raise ValueError("Embeddings not created yet. Call create_embeddings() first.")
         
+        # Normalize embeddings for cosine similarity (projected when configured)
+        normalized_embeddings_float32 = self._search_vectors(self.embeddings)
+        
         # Create FAISS index
-        dimension = self.embeddings.shape[1]
+        dimension = normalized_embeddings_float32.shape[1]
         self.index = faiss.IndexFlatIP(dimension)  # Inner Product for cosine similarity
-        
-        # Normalize embeddings for cosine similarity
-        normalized_embeddings = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
-        normalized_embeddings_float32 = normalized_embeddings.astype('float32')
         self.index.add(x=normalized_embeddings_float32)
+        self.normalized_embeddings = normalized_embeddings_float32
+        self._reset_online_state()
+        self.generation = next(_generation_counter)
         
         logger.info(f"FAISS index created with {self.index.ntotal} vectors")
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self,
+               query: str,
+               top_k: int = 5,
+               filters: Optional[SearchFilters] = None,
+               search_info: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """Search for relevant knowledge items"""
-        if self.index is None:
+        return self.search_batch([query], top_k, filters, search_info)[0]
+    
+    def search_batch(self,
+                     queries: List[str],
+                     top_k: int = 5,
+                     filters: Optional[SearchFilters] = None,
+                     search_info: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Search several queries with one batched encode and one index search.
+        
+        When search_info is given it is filled with 'partial' and
+        'failed_shards' (only ever set on a scatter-gather coordinator).
+        """
+        if self.index is None and self.shards is None and self.remote is None:
             raise ValueError("FAISS index not created yet.")
         
-        # Create query embedding
-        query_embedding = self.model.encode([query])
-        query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
-        
-        # Search
-        distances = np.empty((query_embedding.shape[0], top_k), dtype=np.float32)
-        indices = np.empty((query_embedding.shape[0], top_k), dtype=np.int64)
-        distances, indices = self.index.search(query_embedding.astype('float32'), top_k)
-        
-        results = []
-        for i, (score, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.knowledge_items):
-                item = self.knowledge_items[idx]
-                results.append({
-                    'id': item.id,
-                    'title': item.title,
-                    'content': item.content,
-                    'category': item.category,
-                    'tags': item.tags,
-                    'source_file': item.source_file,
-                    'similarity_score': float(score),
-                    'rank': i + 1
-                })
-        
-        return results
+        if not queries:
+            return []
+        
+        with span("encode", queries=len(queries)):
+            query_embeddings = self.encode_queries(queries)
+        
+        if self.remote is not None:
+            with span("index_search", backend="scatter_gather", top_k=top_k):
+                return self.remote.search(query_embeddings, top_k, filters, search_info)
+        if search_info is not None:
+            search_info.update(partial=False, failed_shards=[])
+        if self.shards is not None:
+            with span("index_search", backend="shards", top_k=top_k):
+                return self.shards.search(query_embeddings, top_k, filters)
+        with span("index_search", backend="faiss", top_k=top_k):
+            return self.search_embeddings(query_embeddings, top_k, filters)
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Unit-normalized float32 query embeddings; uncached queries share one forward pass"""
+        # Whitespace carries no meaning for the encoder, and normalizing it lets
+        # logged queries (see query_log) hit the same cache entries on warm-up
+        queries = [normalize_query(query) for query in queries]
+        vectors = [self.query_cache.get(query) for query in queries]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.encoder.encode([queries[i] for i in missing])
+            encoded = (encoded / np.linalg.norm(encoded, axis=1, keepdims=True)).astype('float32')
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.query_cache.put(queries[i], vector)
+        
+        query_embeddings = np.stack(vectors)
+        if self.projection is not None:
+            query_embeddings = self.projection.project(query_embeddings)
+        return query_embeddings
+    
+    def search_embeddings(self,
+                          query_embeddings: np.ndarray,
+                          top_k: int = 5,
+                          filters: Optional[SearchFilters] = None) -> List[List[Dict[str, Any]]]:
+        """Search with already-encoded queries (used directly by shards)"""
+        if self.index is None:
+            raise ValueError("FAISS index not created yet.")
+        if self.projection is not None:
+            # Full-dimension vectors (e.g. from a scatter-gather coordinator) are projected here
+            query_embeddings = self.projection.project(query_embeddings)
+        
+        # Read the online-write state once so a concurrent write can't be half-seen
+        main_count = self.main_count
+        delta = self.delta_embeddings
+        deleted = self.deleted_bitmap
+        
+        with span("filtering"):
+            allowed = self.metadata_index.resolve(filters)
+            if deleted:
+                allowed = ((1 << self.metadata_index.num_items) - 1 if allowed is None else allowed) & ~deleted
+            if allowed == 0:
+                return [[] for _ in query_embeddings]
+            
+            mask = self.metadata_index.to_mask(allowed) if allowed is not None else None
+        if mask is None:
+            distances, indices = self.index.search(query_embeddings, top_k)
+        else:
+            distances, indices = self._filtered_search(query_embeddings, top_k, mask[:main_count])
+        
+        if delta is not None and len(delta):
+            delta_mask = None if mask is None else mask[main_count:main_count + len(delta)]
+            distances, indices = self._merge_delta(query_embeddings, top_k, distances, indices, delta, delta_mask, main_count)
+        
+        batch_results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for score, idx in zip(row_distances, row_indices):
+                # FAISS pads with -1 when fewer than top_k vectors exist
+                if 0 <= idx < len(self.knowledge_items):
+                    results.append(self._result_dict(idx, score, len(results) + 1))
+            batch_results.append(results)
+        
+        return batch_results
+    
+    def _filtered_search(self, query_embeddings: np.ndarray, top_k: int, mask: np.ndarray):
+        """Top-k search restricted to items whose mask bit is set"""
+        candidate_ids = np.flatnonzero(mask)
+        
+        if len(candidate_ids) <= self.subset_search_limit:
+            # Selective filter: score only the matching vectors exactly
+            scores = query_embeddings @ self._get_normalized_embeddings()[candidate_ids].T
+            k = min(top_k, len(candidate_ids))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            return np.take_along_axis(top_scores, order, axis=1), candidate_ids[np.take_along_axis(top, order, axis=1)]
+        
+        # Broad filter: over-fetch from the index and drop non-matching hits
+        fetch_k = top_k * 4
+        while True:
+            fetch_k = min(fetch_k, self.index.ntotal)
+            distances, indices = self.index.search(query_embeddings, fetch_k)
+            keep = (indices >= 0) & mask[np.clip(indices, 0, len(mask) - 1)]
+            if keep.sum(axis=1).min() >= top_k or fetch_k == self.index.ntotal:
+                break
+            fetch_k *= 4
+        
+        out_distances = np.full((len(indices), top_k), -np.inf, dtype=np.float32)
+        out_indices = np.full((len(indices), top_k), -1, dtype=np.int64)
+        for row in range(len(indices)):
+            kept = np.flatnonzero(keep[row])[:top_k]
+            out_distances[row, :len(kept)] = distances[row, kept]
+            out_indices[row, :len(kept)] = indices[row, kept]
+        return out_distances, out_indices
+    
+    def _merge_delta(self,
+                     query_embeddings: np.ndarray,
+                     top_k: int,
+                     distances: np.ndarray,
+                     indices: np.ndarray,
+                     delta: np.ndarray,
+                     delta_mask: Optional[np.ndarray],
+                     offset: int):
+        """Brute-force the delta segment and merge it with the main index hits"""
+        scores = query_embeddings @ delta.T
+        if delta_mask is not None:
+            scores = np.where(delta_mask[None, :], scores, -np.inf)
+        
+        delta_indices = np.broadcast_to(np.arange(offset, offset + len(delta)), scores.shape)
+        all_distances = np.hstack([np.where(indices >= 0, distances, -np.inf), scores])
+        all_indices = np.hstack([indices, delta_indices])
+        all_indices = np.where(np.isfinite(all_distances), all_indices, -1)
+        
+        order = np.argsort(-all_distances, axis=1)[:, :top_k]
+        return np.take_along_axis(all_distances, order, axis=1), np.take_along_axis(all_indices, order, axis=1)
+    
+    def _get_normalized_embeddings(self) -> np.ndarray:
+        if self.normalized_embeddings is None:
+            if self.embeddings is not None:
+                embeddings = self._search_vectors(self.embeddings)
+            else:
+                embeddings = self.index.reconstruct_n(0, self.index.ntotal)
+            self.normalized_embeddings = embeddings.astype('float32')
+        return self.normalized_embeddings
+    
+    def _result_dict(self, idx: int, score: float, rank: int) -> Dict[str, Any]:
+        item = self.knowledge_items[idx]
+        return {
+            'id': item.id,
+            'title': item.title,
+            'content': item.content,
+            'category': item.category,
+            'tags': item.tags,
+            'source_file': item.source_file,
+            'duplicate_sources': item.duplicate_sources,
+            'similarity_score': float(score),
+            'rank': rank
+        }
+    
+    def multi_query_search(self,
+                           queries: List[str],
+                           top_k: int = 5,
+                           per_query_k: Optional[int] = None,
+                           filters: Optional[SearchFilters] = None,
+                           search_info: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Search several queries in one batch and merge them with reciprocal-rank fusion"""
+        if not queries:
+            return []
+        
+        per_query_k = per_query_k or top_k * 2
+        result_lists = self.search_batch(queries, per_query_k, filters, search_info)
+        return reciprocal_rank_fusion(result_lists, top_k=top_k)
+    
+    def _reset_online_state(self):
+        """The index now covers every item; there is no delta or tombstone"""
+        self.main_count = self.index.ntotal
+        self.delta_embeddings = None
+        self.deleted_bitmap = 0
+        self.id_to_position = {item.id: position for position, item in enumerate(self.knowledge_items)}
+    
+    @property
+    def item_count(self) -> int:
+        """Number of live (searchable, not deleted) items"""
+        if self.remote is not None:
+            return self.remote.facets()['total_items']
+        if self.shards is not None:
+            return self.shards.manifest['total_items']
+        return len(self.id_to_position)
+    
+    def facet_counts(self, facet: str) -> Dict[str, int]:
+        """Item count per category, tag or source value"""
+        if self.remote is not None:
+            return self.remote.facets()[{'category': 'categories', 'tag': 'tags', 'source': 'sources'}[facet]]
+        if self.shards is not None:
+            return self.shards.manifest['facets'][facet]
+        return self.metadata_index.facet_counts(facet)
+    
+    def estimate_memory_bytes(self) -> int:
+        """Approximate resident size of vectors, index and item text"""
+        total = self.index.ntotal * self.index.d * 4 if self.index is not None else 0
+        for array in (self.embeddings, self.normalized_embeddings, self.delta_embeddings):
+            if array is not None:
+                total += array.nbytes
+        for item in self.knowledge_items:
+            total += len(item.title) + len(item.content) + len(item.source_file)
+            if item.embedding is not None:
+                total += item.embedding.nbytes
+        return total
+    
+    @property
+    def pending_changes(self) -> int:
+        """Delta items and tombstones that compaction would fold into the index"""
+        delta_count = 0 if self.delta_embeddings is None else len(self.delta_embeddings)
+        return delta_count + bin(self.deleted_bitmap).count('1')
+    
+    def live_items(self) -> List[KnowledgeItem]:
+        return [self.knowledge_items[position] for position in sorted(self.id_to_position.values())]
+    
+    def upsert_items(self, items: List[KnowledgeItem]) -> Dict[str, int]:
+        """Embed and add items, replacing existing items with the same ID.
+        
+        Only the new text is embedded. Changes are visible to the next search;
+        the FAISS index itself is untouched until compaction. Callers must
+        serialize writes (searches need no locking).
+        """
+        if self.shards is not None or self.remote is not None:
+            raise ValueError("Online writes are not supported on a sharded knowledge base; rebuild instead.")
+        if self.index is None:
+            raise ValueError("FAISS index not created yet.")
+        if not items:
+            return {'inserted': 0, 'replaced': 0}
+        
+        embeddings = self.encoder.encode([f"{item.title}\n\n{item.content}" for item in items])
+        normalized = self._search_vectors(embeddings)
+        
+        superseded = []
+        start = len(self.knowledge_items)
+        for offset, (item, embedding) in enumerate(zip(items, embeddings)):
+            item.embedding = embedding
+            previous = self.id_to_position.get(item.id)
+            if previous is not None:
+                superseded.append(previous)
+            self.knowledge_items.append(item)
+            self.metadata_index.add(start + offset, item)
+            self.id_to_position[item.id] = start + offset
+        
+        # Publish vectors before tombstones so a replaced item never disappears
+        self.delta_embeddings = normalized if self.delta_embeddings is None else np.vstack([self.delta_embeddings, normalized])
+        deleted = self.deleted_bitmap
+        for position in superseded:
+            self.metadata_index.remove(position, self.knowledge_items[position])
+            deleted |= 1 << position
+        self.deleted_bitmap = deleted
+        self.generation = next(_generation_counter)
+        
+        return {'inserted': len(items) - len(superseded), 'replaced': len(superseded)}
+    
+    def delete_item(self, item_id: str) -> bool:
+        """Tombstone an item so searches stop returning it"""
+        if self.shards is not None or self.remote is not None:
+            raise ValueError("Online writes are not supported on a sharded knowledge base; rebuild instead.")
+        position = self.id_to_position.pop(item_id, None)
+        if position is None:
+            return False
+        
+        self.metadata_index.remove(position, self.knowledge_items[position])
+        self.deleted_bitmap |= 1 << position
+        self.generation = next(_generation_counter)
+        return True
+    
+    def _all_vectors(self) -> np.ndarray:
+        """Normalized vectors for every position, main index then delta"""
+        vectors = self._get_normalized_embeddings()
+        if self.delta_embeddings is not None:
+            vectors = np.vstack([vectors, self.delta_embeddings])
+        return vectors
+    
+    def _subset(self, positions: List[int], vectors: np.ndarray) -> "KnowledgeProcessor":
+        """New processor with a fresh FAISS index over the given positions"""
+        processor = KnowledgeProcessor(str(self.data_folder), encoder=self.encoder)
+        processor.knowledge_items = [self.knowledge_items[position] for position in positions]
+        processor.metadata_index = MetadataIndex.build(processor.knowledge_items)
+        # Vectors are already in the search space; the projection passes them through
+        processor.projection = self.projection
+        processor.query_cache = self.query_cache
+        processor.dedup_report = self.dedup_report
+        processor.embeddings = vectors[positions]
+        processor.create_faiss_index()
+        return processor
+    
+    def compacted(self) -> "KnowledgeProcessor":
+        """Copy with deletes dropped and the delta folded into a fresh FAISS index"""
+        return self._subset(sorted(self.id_to_position.values()), self._all_vectors())
+    
+    def partitioned(self, shard_index: int, shard_count: int) -> "KnowledgeProcessor":
+        """The live items assigned to one shard server, by stable hash of item ID"""
+        positions = [
+            position for position in sorted(self.id_to_position.values())
+            if partition_of(self.knowledge_items[position].id, shard_count) == shard_index
+        ]
+        logger.info(f"Partition {shard_index}/{shard_count}: {len(positions)} of {self.item_count} items")
+        return self._subset(positions, self._all_vectors())
     
     def save_knowledge_base(self, output_path: str):
         """Save processed knowledge base to disk"""
@@ -295,9 +753,20 @@ class KnowledgeProcessor:
             json.dump({
                 'knowledge_items': knowledge_data,
                 'total_items': len(knowledge_data),
-                'categories': list(set(item.category for item in self.knowledge_items))
+                'categories': list(set(item.category for item in self.knowledge_items)),
+                'metadata_index': self.metadata_index.to_dict(),
+                'projection': self.projection.describe() if self.projection is not None else None,
+                'encoder': self.encoder.signature(),
+                'deduplication': self.dedup_report
             }, f, indent=2, ensure_ascii=False)
         
+        # Save the projection so queries are mapped into the same space
+        projection_path = f"{output_path}_projection.npz"
+        if self.projection is not None:
+            self.projection.save(projection_path)
+        elif os.path.exists(projection_path):
+            os.remove(projection_path)
+        
         # Save FAISS index
         if self.index is not None:
             faiss.write_index(self.index, f"{output_path}_faiss.index")
@@ -316,6 +785,9 @@ class KnowledgeProcessor:
         with open(f"{input_path}.json", 'r', encoding='utf-8') as f:
             data = json.load(f)
         
+        # Vectors from another encoder would be silently meaningless to search
+        check_signature(data.get('encoder'), self.encoder, f"Knowledge base {input_path}")
+        
         # Reconstruct knowledge items
         self.knowledge_items = []
         for item_dict in data['knowledge_items']:
@@ -325,6 +797,14 @@ class KnowledgeProcessor:
             knowledge_item = KnowledgeItem(**item_dict)
             self.knowledge_items.append(knowledge_item)
         
+        self.dedup_report = data.get('deduplication')
+        
+        # Older knowledge bases have no persisted metadata index
+        if 'metadata_index' in data:
+            self.metadata_index = MetadataIndex.from_dict(data['metadata_index'])
+        else:
+            self.metadata_index = MetadataIndex.build(self.knowledge_items)
+        
         # Load FAISS index
         index_path = f"{input_path}_faiss.index"
         if os.path.exists(index_path):
@@ -334,9 +814,80 @@ class KnowledgeProcessor:
         embeddings_path = f"{input_path}_embeddings.npy"
         if os.path.exists(embeddings_path):
             self.embeddings = np.load(embeddings_path)
+        self.normalized_embeddings = None
+        
+        projection_path = f"{input_path}_projection.npz"
+        self.projection = EmbeddingProjection.load(projection_path) if os.path.exists(projection_path) else None
+        if self.projection is not None:
+            logger.info(f"Using {self.projection.method} projection to {self.projection.output_dim} dimensions")
+        
+        self._reset_online_state()
+        self.generation = next(_generation_counter)
         
         logger.info(f"Loaded {len(self.knowledge_items)} knowledge items")
 
+    def save_shards(self, shard_dir: str):
+        """Save one knowledge base per category plus a manifest of counts"""
+        output_dir = Path(shard_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Saving category shards to {output_dir}")
+        
+        vectors = self._all_vectors()
+        
+        positions_by_category: Dict[str, List[int]] = {}
+        for position in sorted(self.id_to_position.values()):
+            positions_by_category.setdefault(self.knowledge_items[position].category, []).append(position)
+        
+        shards = {}
+        for category, positions in positions_by_category.items():
+            shard = self._subset(positions, vectors)
+            stem = shard_file_stem(category)
+            shard.save_knowledge_base(str(output_dir / stem))
+            shards[category] = {'path': stem, 'items': len(positions)}
+        
+        with open(output_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+            json.dump({
+                'shards': shards,
+                'encoder': self.encoder.signature(),
+                'total_items': self.item_count,
+                'facets': {facet: self.metadata_index.facet_counts(facet) for facet in ('category', 'tag', 'source')}
+            }, f, indent=2, ensure_ascii=False)
+    
+    def load_shards(self, shard_dir: str, memory_budget_bytes: int = 512 * 1024 * 1024):
+        """Serve searches from per-category shards loaded on first use"""
+        def load_shard(path: str) -> "KnowledgeProcessor":
+            shard = KnowledgeProcessor(str(self.data_folder), encoder=self.encoder)
+            shard.load_knowledge_base(path)
+            # Shards are read-only, so per-item embedding copies only cost memory
+            for item in shard.knowledge_items:
+                item.embedding = None
+            return shard
+        
+        shards = ShardManager(shard_dir, load_shard, memory_budget_bytes)
+        # Checked up front; otherwise a mismatch would only surface as failed searches
+        check_signature(shards.manifest.get('encoder'), self.encoder, f"Shard set {shard_dir}")
+        self.shards = shards
+        self.knowledge_items = []
+        self.index = None
+        self.embeddings = None
+        self.normalized_embeddings = None
+        self.metadata_index = MetadataIndex()
+        self.id_to_position = {}
+        self.generation = next(_generation_counter)
+        logger.info(f"Using {len(self.shards.categories)} lazily loaded shards from {shard_dir}")
+    
+    def connect_shard_nodes(self, shard_urls: List[str], deadline_s: float = 0.5):
+        """Act as a scatter-gather coordinator: encode locally, search on shard servers"""
+        self.remote = ScatterGatherClient(shard_urls, deadline_s, encoder=self.encoder.signature())
+        self.knowledge_items = []
+        self.index = None
+        self.embeddings = None
+        self.normalized_embeddings = None
+        self.metadata_index = MetadataIndex()
+        self.id_to_position = {}
+        self.generation = next(_generation_counter)
+        logger.info(f"Coordinating searches across {len(shard_urls)} shard servers")
+
 async def main():
     """Main function to process knowledge base"""
     data_folder = "../Data"  # Path to your Data folder
@@ -1,16 +1,37 @@
 import os
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-import json
 import logging
 from datetime import datetime
 import asyncio
+import time
+import uuid
+import numpy as np
+from contextlib import asynccontextmanager
 
-from knowledge_processor import KnowledgeProcessor
-from ai_service import AIService, AIProvider, ChatMessage
+from knowledge_processor import KnowledgeProcessor, KnowledgeItem, API_SOURCE_PREFIX
+from ai_service import AIService, ChatMessage, configured_providers_from_env
+from provider_router import ProviderUnavailableError
+from retrieval import build_retrieval_queries, extract_keywords
+from reranker import CrossEncoderReranker
+from coalescing import SingleFlight, request_key
+from admission import AdmissionMiddleware, limiter_from_env
+from metadata_index import SearchFilters
+from shards import new_generation_dir, resolve_shard_dir, publish_generation
+from distributed import partition_of
+from payloads import dumps_str, json_response, project_results, get_payload_stats
+from profiling import ProfilingMiddleware, ProfileStore, span, admin_token_valid, ADMIN_TOKEN
+from encoders import check_signature
+from cancellation import (
+    Cancellation, RequestCancelled, DisconnectAwareStreamingResponse, StreamCancellationStats,
+    check_cancelled, run_cancellable
+)
+from sessions import SessionStore, ChatSession, estimate_tokens
+from query_log import QueryLog, read_query_log, most_frequent, replayable
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +44,31 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Admission control per route class. Cheap endpoints (health, categories) are
+# not limited. Added before CORS so rejections still carry CORS headers.
+admission_limiters = {
+    "search": limiter_from_env("search", max_concurrent=8, max_queue=32),
+    "chat": limiter_from_env("chat", max_concurrent=16, max_queue=32),
+    "stream": limiter_from_env("stream", max_concurrent=32, max_queue=32)
+}
+app.add_middleware(
+    AdmissionMiddleware,
+    limiters={
+        "/api/knowledge/search": admission_limiters["search"],
+        "/api/chat": admission_limiters["chat"],
+        "/api/chat/stream": admission_limiters["stream"]
+    }
+)
+
+# On-demand profiling (PROFILE_SAMPLE_RATE, or the X-Debug-Profile header with ADMIN_TOKEN).
+# Outside admission so queueing time shows up in the span tree.
+profile_store = ProfileStore()
+app.add_middleware(
+    ProfilingMiddleware,
+    paths=["/api/knowledge/search", "/api/chat", "/api/chat/stream"],
+    store=profile_store
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -39,67 +85,185 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+DATA_FOLDER = os.getenv("DATA_FOLDER", "../Data")
+KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "knowledge_base")
+COMPACTION_INTERVAL_S = float(os.getenv("KB_COMPACTION_INTERVAL_S", "60"))
+# Optional dimensionality reduction learned when the index is built (0 = off)
+PROJECTION_DIM = int(os.getenv("EMBEDDING_PROJECTION_DIM", "0"))
+PROJECTION_METHOD = os.getenv("EMBEDDING_PROJECTION_METHOD", "pca")
+# Per-category shards loaded lazily under a memory budget
+KB_SHARDED = os.getenv("KB_SHARDED", "false").lower() in ("1", "true", "yes", "on")
+SHARD_DIR = os.getenv("KB_SHARD_DIR", f"{KNOWLEDGE_BASE_PATH}_shards")
+SHARD_MEMORY_BUDGET_BYTES = int(float(os.getenv("SHARD_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+# Scatter-gather: "standalone" (default), "shard" (serves one hash partition)
+# or "coordinator" (encodes queries and fans them out to SHARD_URLS)
+NODE_ROLE = os.getenv("NODE_ROLE", "standalone").lower()
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+SCATTER_DEADLINE_S = float(os.getenv("SCATTER_DEADLINE_MS", "500")) / 1000.0
+PARTITION_PATH = f"{KNOWLEDGE_BASE_PATH}_part{SHARD_INDEX}of{SHARD_COUNT}"
+# Where this node persists its own knowledge base (compaction, rebuilds)
+PERSIST_PATH = PARTITION_PATH if NODE_ROLE == "shard" else KNOWLEDGE_BASE_PATH
+# Pre-warm caches at startup from the most frequent logged queries (0 = off)
+QUERY_LOG_WARM_TOP_N = int(os.getenv("QUERY_LOG_WARM_TOP_N", "100"))
+
 # Global variables
 knowledge_processor: Optional[KnowledgeProcessor] = None
 ai_service: Optional[AIService] = None
+reranker: Optional[CrossEncoderReranker] = None
+session_store: Optional[SessionStore] = None
+query_log: Optional[QueryLog] = None
+
+# Concurrent identical requests share one retrieval + generation
+chat_flight = SingleFlight("chat")
+chat_stream_flight = SingleFlight("chat_stream")
+search_flight = SingleFlight("search")
+# Streams completed vs abandoned by their clients
+stream_cancellation_stats = StreamCancellationStats()
+# Single in-progress rebuild; requests during a rebuild queue at most one rerun
+rebuild_task: Optional[asyncio.Task] = None
+rebuild_rerun_requested = False
+rebuild_metrics = {"started": 0, "completed": 0, "failed": 0, "deduplicated": 0}
+
+# Serializes knowledge-base writers (upserts, deletes, compaction, rebuild swap).
+# Searches never take it: they read whichever processor is current.
+knowledge_write_lock = asyncio.Lock()
+compaction_task: Optional[asyncio.Task] = None
+compaction_metrics = {"runs": 0, "failed": 0, "last_duration_s": None}
+
+COALESCE_DETERMINISTIC = os.getenv("COALESCE_DETERMINISTIC", "true").lower() in ("1", "true", "yes", "on")
 
 # Request/Response models
 class ChatRequest(BaseModel):
-    messages: List[Dict[str, str]]
+    messages: List[Dict[str, str]] = []  # Full history; not needed with session_id
+    session_id: Optional[str] = None  # Server-side history from an earlier response; omit to start one
+    message: Optional[str] = None  # With sessions: only the new user message
     mode: str = "life"
     persona: str = "empathetic"
     enabled_knowledge_packs: List[str] = ["personal"]
     temperature: float = 0.7
     max_tokens: int = 1000
     stream: bool = False
+    retrieval_mode: str = "multi_query"  # multi_query or single
+    rerank: bool = False
+    rerank_candidates: int = 50
+    coalesce: Optional[bool] = None  # Defaults to coalescing deterministic (temperature 0) requests
+    source_fields: Optional[List[str]] = None  # e.g. ["id", "title", "snippet"]; None returns full sources
 
 class ChatResponse(BaseModel):
     response: str
     sources: List[Dict[str, Any]] = []
     processing_time: float
     tokens_used: Optional[int] = None
+    session_id: Optional[str] = None
 
 class KnowledgeSearchRequest(BaseModel):
     query: str
     top_k: int = 5
     categories: List[str] = []
+    tags_any: List[str] = []
+    tags_all: List[str] = []
+    exclude_tags: List[str] = []
+    sources: List[str] = []
+    rerank: bool = False
+    rerank_candidates: int = 50
+    fields: Optional[List[str]] = None  # e.g. ["id", "title", "score", "snippet"]; None returns full items
+    snippet_chars: int = 240
 
 class KnowledgeSearchResponse(BaseModel):
     results: List[Dict[str, Any]]
     total_found: int
+    partial: bool = False  # Some shard servers failed or missed the deadline
+    failed_shards: List[str] = []
+
+class ShardSearchRequest(BaseModel):
+    embeddings: List[List[float]]  # Unit-normalized query vectors from the coordinator
+    top_k: int = 5
+    filters: Optional[Dict[str, List[str]]] = None
+    encoder: Optional[Dict[str, Any]] = None  # Signature of the coordinator's encoder
+
+class KnowledgeItemInput(BaseModel):
+    id: Optional[str] = None  # Generated when omitted; an existing ID is replaced
+    title: str
+    content: str
+    category: str = "general"
+    tags: List[str] = []
+    source: str = "api"
+
+class KnowledgeUpsertRequest(BaseModel):
+    items: List[KnowledgeItemInput]
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
-    global knowledge_processor, ai_service
+    global knowledge_processor, ai_service, reranker, session_store, query_log, compaction_task
     
     logger.info("Starting RoamMentor AI Backend...")
     
     try:
         # Initialize knowledge processor
-        knowledge_processor = KnowledgeProcessor("../Data")
+        knowledge_processor = KnowledgeProcessor(DATA_FOLDER)
         
         # Try to load existing knowledge base
-        knowledge_base_path = "knowledge_base"
-        if os.path.exists(f"{knowledge_base_path}.json"):
+        knowledge_base_path = KNOWLEDGE_BASE_PATH
+        if NODE_ROLE == "coordinator":
+            # No local index: only the model for encoding queries
+            knowledge_processor.connect_shard_nodes(SHARD_URLS, SCATTER_DEADLINE_S)
+        elif NODE_ROLE == "shard" and os.path.exists(f"{PARTITION_PATH}.json"):
+            logger.info(f"Loading knowledge base partition {SHARD_INDEX}/{SHARD_COUNT}...")
+            knowledge_processor.load_knowledge_base(PARTITION_PATH)
+        elif KB_SHARDED and resolve_shard_dir(SHARD_DIR) is not None:
+            logger.info("Loading sharded knowledge base...")
+            knowledge_processor.load_shards(str(resolve_shard_dir(SHARD_DIR)), SHARD_MEMORY_BUDGET_BYTES)
+        elif os.path.exists(f"{knowledge_base_path}.json"):
             logger.info("Loading existing knowledge base...")
             knowledge_processor.load_knowledge_base(knowledge_base_path)
         else:
             logger.info("Creating new knowledge base...")
             await knowledge_processor.process_all_files()
             knowledge_processor.create_embeddings()
+            if PROJECTION_DIM:
+                knowledge_processor.fit_projection(PROJECTION_DIM, PROJECTION_METHOD)
             knowledge_processor.create_faiss_index()
-            knowledge_processor.save_knowledge_base(knowledge_base_path)
+            if NODE_ROLE != "shard":
+                # Shard servers starting together would race on the shared files
+                knowledge_processor.save_knowledge_base(knowledge_base_path)
+        
+        if NODE_ROLE == "shard" and not os.path.exists(f"{PARTITION_PATH}.json"):
+            # First start of this shard server: keep only its partition
+            knowledge_processor = knowledge_processor.partitioned(SHARD_INDEX, SHARD_COUNT)
+            knowledge_processor.save_knowledge_base(PARTITION_PATH)
+        
+        if KB_SHARDED and NODE_ROLE == "standalone" and knowledge_processor.shards is None:
+            # First sharded start: split the full knowledge base per category
+            generation_dir = new_generation_dir(SHARD_DIR)
+            knowledge_processor.save_shards(str(generation_dir))
+            publish_generation(SHARD_DIR, generation_dir)
+            knowledge_processor.load_shards(str(generation_dir), SHARD_MEMORY_BUDGET_BYTES)
+        
+        # Warm the query embedding cache (and lazily loaded shards) before serving
+        query_log = QueryLog.from_env()
+        if query_log and QUERY_LOG_WARM_TOP_N:
+            await run_in_threadpool(warm_caches_from_query_log, query_log.path, QUERY_LOG_WARM_TOP_N)
         
-        # Initialize AI service
-        ai_provider = AIProvider.OPENAI  # Default to OpenAI
-        if os.getenv("ANTHROPIC_API_KEY"):
-            ai_provider = AIProvider.ANTHROPIC
-        elif not os.getenv("OPENAI_API_KEY"):
+        # Fold online writes into the index and persist them periodically
+        compaction_task = asyncio.create_task(compaction_loop())
+        
+        # Cross-encoder loads in the background; reranking falls back to fused order until it is ready
+        reranker = CrossEncoderReranker.from_env()
+        reranker.start_loading()
+        
+        session_store = SessionStore.from_env()
+        
+        # Initialize AI service with every configured provider, in priority order
+        ai_providers = configured_providers_from_env()
+        if ai_providers:
+            ai_service = AIService(providers=ai_providers)
+            logger.info(f"AI providers: {', '.join(backend.name for backend in ai_service.backends)}")
+        else:
             logger.warning("No AI API keys found. Using mock responses.")
             ai_service = None
-        else:
-            ai_service = AIService(ai_provider)
         
         logger.info("RoamMentor AI Backend started successfully!")
         
@@ -107,6 +271,160 @@ async def startup_event():
         logger.error(f"Failed to start backend: {e}")
         raise
 
+def retrieve_relevant_knowledge(request: ChatRequest, top_k: int = 5) -> List[Dict[str, Any]]:
+    """Retrieve knowledge for a chat request and filter it by enabled packs"""
+    user_messages = [msg for msg in request.messages if msg["role"] == "user"]
+    if not user_messages:
+        return []
+    
+    latest_query = user_messages[-1]["content"]
+    # Rerank a wider candidate set down to top_k
+    candidate_k = max(top_k, request.rerank_candidates) if request.rerank else top_k
+    
+    # Restrict retrieval to enabled knowledge packs via the metadata index
+    filters = SearchFilters(categories=request.enabled_knowledge_packs)
+    
+    with span("retrieval", mode=request.retrieval_mode):
+        if request.retrieval_mode == "single":
+            relevant_knowledge = knowledge_processor.search(latest_query, top_k=candidate_k, filters=filters)
+        else:
+            # Latest turn, latest + previous turn and keywords in one batched search
+            queries = build_retrieval_queries(request.messages)
+            relevant_knowledge = knowledge_processor.multi_query_search(queries, top_k=candidate_k, filters=filters)
+        
+        if request.rerank and reranker:
+            # Skip the cross-encoder for a client that has already gone
+            check_cancelled()
+            with span("rerank", candidates=len(relevant_knowledge)):
+                relevant_knowledge = reranker.rerank(latest_query, relevant_knowledge, top_k=top_k)
+    
+    return relevant_knowledge[:top_k]
+
+def uses_session(request: ChatRequest) -> bool:
+    return request.session_id is not None or request.message is not None
+
+@asynccontextmanager
+async def session_turn(request: ChatRequest):
+    """Hold a session for one turn: add the new message and send its window as history.
+    
+    Yields None for requests that carry their full history themselves.
+    """
+    if not uses_session(request):
+        yield None
+        return
+    
+    message = request.message
+    if message is None and request.messages:
+        message = request.messages[-1]["content"]
+    if not message or not message.strip():
+        raise HTTPException(status_code=400, detail="No user message found")
+    
+    # Only IDs the server issued are accepted, so a client cannot pick (or guess) another's session
+    session = session_store.get(request.session_id) if request.session_id else session_store.create()
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired; omit session_id to start a new one")
+    # One turn at a time per session, so history stays in order
+    async with session.lock:
+        snapshot = session_store.snapshot(session)
+        session_store.append(session, "user", message)
+        request.messages = list(session.messages)
+        try:
+            yield session
+        except BaseException:
+            session_store.rollback(session, snapshot)
+            raise
+
+async def finish_session_turn(session: Optional[ChatSession], response: str):
+    """Record the assistant reply and persist the session"""
+    if session is None:
+        return
+    session_store.append(session, "assistant", response)
+    await run_in_threadpool(session_store.save, session)
+
+def logged_chat_retrieval(request: ChatRequest, top_k: int = 5) -> List[Dict[str, Any]]:
+    """Retrieve knowledge for a chat request and record it in the query log"""
+    if query_log is None:
+        return retrieve_relevant_knowledge(request, top_k)
+    
+    started = time.perf_counter()
+    relevant_knowledge = retrieve_relevant_knowledge(request, top_k)
+    user_messages = [msg for msg in request.messages if msg["role"] == "user"]
+    if user_messages:
+        query_log.record(
+            "chat",
+            user_messages[-1]["content"],
+            top_k,
+            (time.perf_counter() - started) * 1000.0,
+            [item['id'] for item in relevant_knowledge],
+            filters={"categories": sorted(request.enabled_knowledge_packs)},
+            queries=build_retrieval_queries(request.messages) if request.retrieval_mode != "single" else None,
+            rerank=request.rerank
+        )
+    return relevant_knowledge
+
+def retrieve_chat_knowledge(request: ChatRequest, session: Optional[ChatSession] = None, top_k: int = 5) -> List[Dict[str, Any]]:
+    """Retrieval for a chat turn, reusing the session's last context when it still applies.
+    
+    The context is reused for a repeated question, and for follow-ups with
+    nothing to search for ("thanks", "go on"), as long as the knowledge
+    base has not changed since.
+    """
+    if session is None:
+        return logged_chat_retrieval(request, top_k)
+    
+    latest_query = request.messages[-1]["content"]
+    # Retrieval settings must match; the query may differ for follow-ups
+    key = request_key(
+        packs=sorted(request.enabled_knowledge_packs),
+        retrieval_mode=request.retrieval_mode,
+        rerank=request.rerank,
+        rerank_candidates=request.rerank_candidates if request.rerank else None,
+        top_k=top_k,
+        generation=knowledge_processor.generation
+    )
+    cached = session.retrieval_context
+    if cached is not None and cached[0] == key and (cached[1] == latest_query or not extract_keywords(latest_query)):
+        session_store.metrics['retrieval_reused'] += 1
+        return cached[2]
+    
+    relevant_knowledge = logged_chat_retrieval(request, top_k)
+    # An abandoned turn must not overwrite context a newer turn may already be using
+    check_cancelled()
+    session.retrieval_context = (key, latest_query, relevant_knowledge)
+    session_store.metrics['retrieval_fresh'] += 1
+    return relevant_knowledge
+
+def with_session_summary(system_prompt: str, session: Optional[ChatSession]) -> str:
+    """Add the summary of turns compacted out of the session window"""
+    if session is None or not session.summary_lines:
+        return system_prompt
+    return system_prompt + f"\n**Earlier in this Conversation (summary):**\n{session.summary}\n"
+
+def should_coalesce(request: ChatRequest) -> bool:
+    """Explicit opt-in/out wins; otherwise only deterministic requests are shared"""
+    if uses_session(request):
+        # Each turn changes per-session state
+        return False
+    if request.coalesce is not None:
+        return request.coalesce
+    return COALESCE_DETERMINISTIC and request.temperature == 0
+
+def chat_request_key(request: ChatRequest) -> str:
+    """Coalescing key covering everything that can change the answer"""
+    return request_key(
+        messages=[{"role": msg["role"], "content": msg["content"]} for msg in request.messages],
+        mode=request.mode,
+        persona=request.persona,
+        packs=sorted(request.enabled_knowledge_packs),
+        temperature=request.temperature,
+        max_tokens=request.max_tokens,
+        retrieval_mode=request.retrieval_mode,
+        rerank=request.rerank,
+        rerank_candidates=request.rerank_candidates if request.rerank else None,
+        source_fields=request.source_fields,
+        generation=knowledge_processor.generation
+    )
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -115,7 +433,7 @@ async def root():
         "version": "1.0.0",
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "knowledge_items": len(knowledge_processor.knowledge_items) if knowledge_processor else 0,
+        "knowledge_items": knowledge_processor.item_count if knowledge_processor else 0,
         "ai_service_available": ai_service is not None
     }
 
@@ -127,13 +445,53 @@ async def health_check():
         "services": {
             "knowledge_processor": knowledge_processor is not None,
             "ai_service": ai_service is not None,
-            "knowledge_items_count": len(knowledge_processor.knowledge_items) if knowledge_processor else 0
+            "knowledge_items_count": knowledge_processor.item_count if knowledge_processor else 0
         },
         "timestamp": datetime.now().isoformat()
     }
 
+async def run_chat(request: ChatRequest, latest_query: str, session: Optional[ChatSession] = None):
+    """Retrieve context and generate a full response for a chat request"""
+    # Search for relevant knowledge off the event loop
+    relevant_knowledge = await run_in_threadpool(retrieve_chat_knowledge, request, session, 5)
+    
+    # Generate AI response
+    if ai_service:
+        # Convert request messages to ChatMessage objects
+        chat_messages = [
+            ChatMessage(role=msg["role"], content=msg["content"]) 
+            for msg in request.messages
+        ]
+        
+        # Create system prompt with context
+        with span("prompt_build", sources=len(relevant_knowledge)):
+            system_prompt = ai_service.create_system_prompt(
+                request.mode, 
+                request.persona, 
+                relevant_knowledge
+            )
+            system_prompt = with_session_summary(system_prompt, session)
+        
+        # Generate response
+        ai_response = await ai_service.generate_response(
+            chat_messages,
+            system_prompt,
+            request.temperature,
+            request.max_tokens
+        )
+    else:
+        # Fallback to mock response
+        ai_response = generate_mock_response(
+            latest_query, 
+            request.mode, 
+            request.persona, 
+            relevant_knowledge
+        )
+    
+    return ai_response, relevant_knowledge
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """Main chat endpoint"""
     start_time = datetime.now()
     
@@ -141,62 +499,45 @@ async def chat(request: ChatRequest):
         if not knowledge_processor:
             raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
         
-        # Extract user query from messages
-        user_messages = [msg for msg in request.messages if msg["role"] == "user"]
-        if not user_messages:
-            raise HTTPException(status_code=400, detail="No user message found")
-        
-        latest_query = user_messages[-1]["content"]
-        
-        # Search for relevant knowledge
-        relevant_knowledge = knowledge_processor.search(latest_query, top_k=5)
-        
-        # Filter by enabled knowledge packs if specified
-        if request.enabled_knowledge_packs:
-            relevant_knowledge = [
-                item for item in relevant_knowledge 
-                if item["category"] in request.enabled_knowledge_packs
-            ]
-        
-        # Generate AI response
-        if ai_service:
-            # Convert request messages to ChatMessage objects
-            chat_messages = [
-                ChatMessage(role=msg["role"], content=msg["content"]) 
-                for msg in request.messages
-            ]
+        async with session_turn(request) as session:
+            # Extract user query from messages
+            user_messages = [msg for msg in request.messages if msg["role"] == "user"]
+            if not user_messages:
+                raise HTTPException(status_code=400, detail="No user message found")
             
-            # Create system prompt with context
-            system_prompt = ai_service.create_system_prompt(
-                request.mode, 
-                request.persona, 
-                relevant_knowledge
-            )
+            latest_query = user_messages[-1]["content"]
             
-            # Generate response
-            ai_response = await ai_service.generate_response(
-                chat_messages,
-                system_prompt,
-                request.temperature,
-                request.max_tokens
-            )
-        else:
-            # Fallback to mock response
-            ai_response = generate_mock_response(
-                latest_query, 
-                request.mode, 
-                request.persona, 
-                relevant_knowledge
-            )
+            if should_coalesce(request):
+                ai_response, relevant_knowledge = await chat_flight.do(
+                    chat_request_key(request),
+                    lambda: run_chat(request, latest_query)
+                )
+            else:
+                ai_response, relevant_knowledge = await run_chat(request, latest_query, session)
+            
+            await finish_session_turn(session, ai_response)
         
         processing_time = (datetime.now() - start_time).total_seconds()
         
-        return ChatResponse(
-            response=ai_response,
-            sources=relevant_knowledge[:3],  # Return top 3 sources
-            processing_time=processing_time
-        )
+        # Same shape as ChatResponse, encoded on the fast path
+        with span("serialization"):
+            return json_response(
+                {
+                    "response": ai_response,
+                    "sources": project_results(relevant_knowledge[:3], request.source_fields, latest_query),  # Return top 3 sources
+                    "processing_time": processing_time,
+                    "tokens_used": None,
+                    "session_id": session.id if session else None
+                },
+                route="chat",
+                accept_encoding=http_request.headers.get("accept-encoding", "")
+            )
         
+    except HTTPException:
+        raise
+    except ProviderUnavailableError as e:
+        logger.error(f"No AI provider available: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -206,77 +547,114 @@ async def chat_stream(request: ChatRequest):
     """Streaming chat endpoint"""
     
     async def generate_stream():
+        stage = "retrieval"
+        response_chunks = []
         try:
             if not knowledge_processor:
-                yield f"data: {json.dumps({'error': 'Knowledge processor not initialized'})}\n\n"
+                yield f"data: {dumps_str({'error': 'Knowledge processor not initialized'})}\n\n"
                 return
             
-            # Search for relevant knowledge
-            user_messages = [msg for msg in request.messages if msg["role"] == "user"]
-            if user_messages:
-                latest_query = user_messages[-1]["content"]
-                relevant_knowledge = knowledge_processor.search(latest_query, top_k=5)
+            async with session_turn(request) as session:
+                if session is not None:
+                    # Sent first so a new client learns its session ID
+                    yield f"data: {dumps_str({'session_id': session.id})}\n\n"
                 
-                # Filter by enabled knowledge packs
-                if request.enabled_knowledge_packs:
-                    relevant_knowledge = [
-                        item for item in relevant_knowledge 
-                        if item["category"] in request.enabled_knowledge_packs
-                    ]
-            else:
-                relevant_knowledge = []
-            
-            if ai_service:
-                # Convert to ChatMessage objects
-                chat_messages = [
-                    ChatMessage(role=msg["role"], content=msg["content"]) 
-                    for msg in request.messages
-                ]
+                # Search for relevant knowledge; a disconnect stops waiting for it at once
+                user_messages = [msg for msg in request.messages if msg["role"] == "user"]
+                latest_query = user_messages[-1]["content"] if user_messages else ""
+                relevant_knowledge = await run_cancellable(retrieve_chat_knowledge, request, session, 5)
+                stage = "generation"
                 
-                # Create system prompt
-                system_prompt = ai_service.create_system_prompt(
-                    request.mode, 
-                    request.persona, 
-                    relevant_knowledge
-                )
-                
-                # Stream response
-                async for chunk in ai_service.stream_response(
-                    chat_messages,
-                    system_prompt,
-                    request.temperature,
-                    request.max_tokens
-                ):
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
+                if ai_service:
+                    # Convert to ChatMessage objects
+                    chat_messages = [
+                        ChatMessage(role=msg["role"], content=msg["content"]) 
+                        for msg in request.messages
+                    ]
                     
-                # Send sources at the end
-                yield f"data: {json.dumps({'sources': relevant_knowledge[:3]})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
-            else:
-                # Mock streaming response
-                mock_response = generate_mock_response(
-                    latest_query if user_messages else "Hello",
-                    request.mode,
-                    request.persona,
-                    relevant_knowledge
-                )
-                
-                # Simulate streaming by sending chunks
-                words = mock_response.split()
-                for i in range(0, len(words), 3):  # Send 3 words at a time
-                    chunk = " ".join(words[i:i+3]) + " "
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
-                    await asyncio.sleep(0.1)  # Small delay for realism
-                
-                yield f"data: {json.dumps({'sources': relevant_knowledge[:3]})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                    # Create system prompt
+                    with span("prompt_build", sources=len(relevant_knowledge)):
+                        system_prompt = ai_service.create_system_prompt(
+                            request.mode, 
+                            request.persona, 
+                            relevant_knowledge
+                        )
+                        system_prompt = with_session_summary(system_prompt, session)
+                    
+                    # Stream response, closing the provider stream as soon as we stop reading
+                    provider_stream = ai_service.stream_response(
+                        chat_messages,
+                        system_prompt,
+                        request.temperature,
+                        request.max_tokens
+                    )
+                    try:
+                        async for chunk in provider_stream:
+                            response_chunks.append(chunk)
+                            yield f"data: {dumps_str({'content': chunk})}\n\n"
+                    finally:
+                        await provider_stream.aclose()
+                    
+                    stream_cancellation_stats.record_completed(estimate_tokens("".join(response_chunks)))
+                    stage = "done"
+                    await finish_session_turn(session, "".join(response_chunks))
+                        
+                    # Send sources at the end
+                    yield f"data: {dumps_str({'sources': project_results(relevant_knowledge[:3], request.source_fields, latest_query)})}\n\n"
+                    yield f"data: {dumps_str({'done': True})}\n\n"
+                else:
+                    # Mock streaming response
+                    mock_response = generate_mock_response(
+                        latest_query or "Hello",
+                        request.mode,
+                        request.persona,
+                        relevant_knowledge
+                    )
+                    
+                    # Simulate streaming by sending chunks
+                    words = mock_response.split()
+                    for i in range(0, len(words), 3):  # Send 3 words at a time
+                        chunk = " ".join(words[i:i+3]) + " "
+                        yield f"data: {dumps_str({'content': chunk})}\n\n"
+                        await asyncio.sleep(0.1)  # Small delay for realism
+                    
+                    stream_cancellation_stats.record_completed(0)
+                    stage = "done"
+                    await finish_session_turn(session, mock_response)
+                    
+                    yield f"data: {dumps_str({'sources': project_results(relevant_knowledge[:3], request.source_fields, latest_query)})}\n\n"
+                    yield f"data: {dumps_str({'done': True})}\n\n"
                 
+        except (asyncio.CancelledError, GeneratorExit, RequestCancelled) as e:
+            # The client went away: the session turn was rolled back and the provider stream closed
+            if stage != "done":
+                saved = stream_cancellation_stats.record_cancelled(
+                    stage,
+                    estimate_tokens("".join(response_chunks)) if response_chunks else 0,
+                    request.max_tokens if ai_service else None
+                )
+                logger.info(f"Stream cancelled during {stage} (~{saved} completion tokens saved)")
+            if not isinstance(e, RequestCancelled):
+                raise
+        except HTTPException as e:
+            yield f"data: {dumps_str({'error': e.detail})}\n\n"
         except Exception as e:
             logger.error(f"Error in streaming: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield f"data: {dumps_str({'error': str(e)})}\n\n"
+    
+    cancellation = None
+    if knowledge_processor and should_coalesce(request):
+        # Fan the same token stream out to every identical concurrent client;
+        # the shared stream is cancelled only when every client has gone
+        stream = chat_stream_flight.stream(chat_request_key(request), generate_stream)
+    else:
+        stream = generate_stream()
+        cancellation = Cancellation()
     
-    return StreamingResponse(
-        generate_stream(),
+    return DisconnectAwareStreamingResponse(
+        stream,
+        cancellation=cancellation,
+        stats=stream_cancellation_stats,
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -285,33 +663,108 @@ async def chat_stream(request: ChatRequest):
         }
     )
 
+def search_filters(request: KnowledgeSearchRequest) -> SearchFilters:
+    """Metadata filters for a knowledge search request"""
+    return SearchFilters(
+        categories=request.categories,
+        tags_any=request.tags_any,
+        tags_all=request.tags_all,
+        exclude_tags=request.exclude_tags,
+        sources=request.sources
+    )
+
+def run_knowledge_search(request: KnowledgeSearchRequest):
+    """Search with metadata filters and optionally rerank for a knowledge search request.
+    
+    Returns the results and the search info (partial-result flag).
+    """
+    candidate_k = max(request.top_k, request.rerank_candidates) if request.rerank else request.top_k
+    search_info: Dict[str, Any] = {}
+    results = knowledge_processor.search(request.query, candidate_k, filters=search_filters(request), search_info=search_info)
+    
+    if request.rerank and reranker:
+        with span("rerank", candidates=len(results)):
+            results = reranker.rerank(request.query, results, top_k=request.top_k)
+    return results[:request.top_k], search_info
+
 @app.post("/api/knowledge/search", response_model=KnowledgeSearchResponse)
-async def search_knowledge(request: KnowledgeSearchRequest):
+async def search_knowledge(request: KnowledgeSearchRequest, http_request: Request):
     """Search knowledge base endpoint"""
     
     try:
         if not knowledge_processor:
             raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
         
-        # Search knowledge base
-        results = knowledge_processor.search(request.query, request.top_k)
-        
-        # Filter by categories if specified
-        if request.categories:
-            results = [
-                item for item in results 
-                if item["category"] in request.categories
-            ]
-        
-        return KnowledgeSearchResponse(
-            results=results,
-            total_found=len(results)
+        # Search is deterministic, so identical concurrent searches always share one run
+        key = request_key(
+            query=request.query,
+            top_k=request.top_k,
+            filters=search_filters(request).cache_key(),
+            rerank=request.rerank,
+            rerank_candidates=request.rerank_candidates if request.rerank else None,
+            generation=knowledge_processor.generation
         )
+        started = time.perf_counter()
+        with span("retrieval"):
+            results, search_info = await search_flight.do(key, lambda: run_in_threadpool(run_knowledge_search, request))
+        if query_log:
+            query_log.record(
+                "search",
+                request.query,
+                request.top_k,
+                (time.perf_counter() - started) * 1000.0,
+                [item['id'] for item in results],
+                filters=search_filters(request).cache_key(),
+                rerank=request.rerank
+            )
         
+        # Same shape as KnowledgeSearchResponse, encoded on the fast path
+        with span("serialization"):
+            return json_response(
+                {
+                    "results": project_results(results, request.fields, request.query, request.snippet_chars),
+                    "total_found": len(results),
+                    "partial": search_info.get("partial", False),
+                    "failed_shards": search_info.get("failed_shards", [])
+                },
+                route="search",
+                accept_encoding=http_request.headers.get("accept-encoding", "")
+            )
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in knowledge search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/shard/search")
+async def shard_search(request: ShardSearchRequest):
+    """Search this shard server's partition with query vectors from a coordinator"""
+    
+    if NODE_ROLE != "shard":
+        raise HTTPException(status_code=404, detail="Not a shard server")
+    if not knowledge_processor:
+        raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
+    if request.encoder is not None:
+        try:
+            check_signature(request.encoder, knowledge_processor.encoder, "Coordinator query")
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
+    query_embeddings = np.asarray(request.embeddings, dtype='float32')
+    filters = SearchFilters(**request.filters) if request.filters else None
+    results = await run_in_threadpool(knowledge_processor.search_embeddings, query_embeddings, request.top_k, filters)
+    
+    return json_response(
+        {
+            "results": results,
+            "shard_index": SHARD_INDEX,
+            "shard_count": SHARD_COUNT,
+            "generation": knowledge_processor.generation
+        },
+        route="shard"
+    )
+
 @app.get("/api/knowledge/categories")
 async def get_knowledge_categories():
     """Get available knowledge categories"""
@@ -319,41 +772,337 @@ async def get_knowledge_categories():
     if not knowledge_processor:
         raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
     
-    categories = list(set(item.category for item in knowledge_processor.knowledge_items))
-    category_counts = {}
-    
-    for category in categories:
-        count = sum(1 for item in knowledge_processor.knowledge_items if item.category == category)
-        category_counts[category] = count
+    # Counts are precomputed by the metadata index at ingest time
+    category_counts = dict(knowledge_processor.facet_counts("category"))
     
     return {
-        "categories": categories,
+        "categories": list(category_counts),
         "category_counts": category_counts,
-        "total_items": len(knowledge_processor.knowledge_items)
+        "total_items": knowledge_processor.item_count
     }
 
-@app.post("/api/knowledge/rebuild")
-async def rebuild_knowledge_base(background_tasks: BackgroundTasks):
-    """Rebuild knowledge base from source files"""
+@app.get("/api/knowledge/facets")
+async def get_knowledge_facets():
+    """Item counts per category, tag and source file"""
     
-    async def rebuild_task():
-        global knowledge_processor
+    if not knowledge_processor:
+        raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
+    
+    return {
+        "categories": knowledge_processor.facet_counts("category"),
+        "tags": knowledge_processor.facet_counts("tag"),
+        "sources": knowledge_processor.facet_counts("source"),
+        "total_items": knowledge_processor.item_count
+    }
+
+def owns_item(item_id: str) -> bool:
+    """Whether this node holds item_id: always, except on a shard server outside its hash partition"""
+    return NODE_ROLE != "shard" or partition_of(item_id, SHARD_COUNT) == SHARD_INDEX
+
+def new_item_id() -> str:
+    # On a shard server, draw until the ID hashes to this node's partition (SHARD_COUNT tries on average)
+    while True:
+        item_id = f"api_{uuid.uuid4().hex[:12]}"
+        if owns_item(item_id):
+            return item_id
+
+@app.post("/api/knowledge/items")
+async def upsert_knowledge_items(request: KnowledgeUpsertRequest):
+    """Add or replace knowledge items without a full rebuild"""
+    
+    if not knowledge_processor:
+        raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
+    if knowledge_processor.shards is not None or knowledge_processor.remote is not None:
+        raise HTTPException(status_code=409, detail="Online writes are not supported on a sharded knowledge base")
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    # A copy on the wrong shard server would never be replaced or deleted through its owner
+    misrouted = [item.id for item in request.items if item.id and not owns_item(item.id)]
+    if misrouted:
+        raise HTTPException(
+            status_code=409,
+            detail="Items belong to other shards: " + ", ".join(
+                f"{item_id} (shard {partition_of(item_id, SHARD_COUNT)})" for item_id in misrouted
+            )
+        )
+    
+    items = [
+        KnowledgeItem(
+            id=item.id or new_item_id(),
+            title=item.title,
+            content=item.content.strip(),
+            source_file=f"{API_SOURCE_PREFIX}{item.source}",
+            category=item.category,
+            tags=item.tags
+        )
+        for item in request.items
+    ]
+    
+    try:
+        async with knowledge_write_lock:
+            # Only the new text is embedded; searches keep running meanwhile
+            counts = await run_in_threadpool(knowledge_processor.upsert_items, items)
+    except Exception as e:
+        logger.error(f"Error upserting knowledge items: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        **counts,
+        "ids": [item.id for item in items],
+        "total_items": knowledge_processor.item_count
+    }
+
+@app.delete("/api/knowledge/items/{item_id}")
+async def delete_knowledge_item(item_id: str):
+    """Remove a knowledge item without a full rebuild"""
+    
+    if not knowledge_processor:
+        raise HTTPException(status_code=500, detail="Knowledge processor not initialized")
+    if knowledge_processor.shards is not None or knowledge_processor.remote is not None:
+        raise HTTPException(status_code=409, detail="Online writes are not supported on a sharded knowledge base")
+    if not owns_item(item_id):
+        raise HTTPException(status_code=409, detail=f"Item {item_id} belongs to shard {partition_of(item_id, SHARD_COUNT)}")
+    
+    async with knowledge_write_lock:
+        deleted = knowledge_processor.delete_item(item_id)
+    
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Knowledge item {item_id} not found")
+    
+    return {
+        "deleted": item_id,
+        "total_items": knowledge_processor.item_count
+    }
+
+async def compact_knowledge_base():
+    """Fold online writes into a fresh index and persist it"""
+    global knowledge_processor
+    
+    started = datetime.now()
+    async with knowledge_write_lock:
+        if not knowledge_processor or not knowledge_processor.pending_changes:
+            return
+        compacted = await run_in_threadpool(knowledge_processor.compacted)
+        # Saved under the lock so the files match the index being swapped in
+        await run_in_threadpool(compacted.save_knowledge_base, PERSIST_PATH)
+        knowledge_processor = compacted
+    
+    compaction_metrics["runs"] += 1
+    compaction_metrics["last_duration_s"] = (datetime.now() - started).total_seconds()
+    logger.info(f"Compacted knowledge base to {compacted.item_count} items")
+
+async def compaction_loop():
+    """Periodically compact and persist the knowledge base in the background"""
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_S)
+        try:
+            await compact_knowledge_base()
+        except Exception as e:
+            compaction_metrics["failed"] += 1
+            logger.error(f"Error compacting knowledge base: {e}")
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime metrics for retrieval components"""
+    return {
+        "reranker": reranker.get_stats() if reranker else None,
+        "ai_providers": ai_service.get_stats() if ai_service else None,
+        "knowledge_base": {
+            "items": knowledge_processor.item_count if knowledge_processor else 0,
+            "pending_changes": knowledge_processor.pending_changes if knowledge_processor else 0,
+            "generation": knowledge_processor.generation if knowledge_processor else None,
+            "encoder": knowledge_processor.encoder.signature() if knowledge_processor else None,
+            "deduplication": {
+                key: value for key, value in knowledge_processor.dedup_report.items() if key != "collapsed"
+            } if knowledge_processor and knowledge_processor.dedup_report else None,
+            "projection": knowledge_processor.projection.describe() if knowledge_processor and knowledge_processor.projection else None,
+            "query_cache": knowledge_processor.query_cache.get_stats() if knowledge_processor else None,
+            "compaction": compaction_metrics,
+            "shards": knowledge_processor.shards.get_stats() if knowledge_processor and knowledge_processor.shards else None,
+            "node_role": NODE_ROLE,
+            "scatter_gather": knowledge_processor.remote.get_stats() if knowledge_processor and knowledge_processor.remote else None
+        },
+        "admission": {name: limiter.get_stats() for name, limiter in admission_limiters.items()},
+        "rebuild": {
+            **rebuild_metrics,
+            "in_progress": rebuild_task is not None and not rebuild_task.done(),
+            "rerun_queued": rebuild_rerun_requested
+        },
+        "payloads": get_payload_stats(),
+        "profiling": profile_store.get_stats(),
+        "sessions": session_store.get_stats() if session_store else None,
+        "query_log": query_log.get_stats() if query_log else None,
+        "stream_cancellation": stream_cancellation_stats.get_stats(),
+        "coalescing": {
+            flight.name: flight.get_stats()
+            for flight in (chat_flight, chat_stream_flight, search_flight)
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+def require_admin(request: Request):
+    """Admin endpoints answer only to the X-Admin-Token header, and do not exist without ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token_valid(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str, request: Request):
+    """Recent turns and summary of a chat session (admin only)"""
+    require_admin(request)
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {
+        "session_id": session.id,
+        "messages": session.messages,
+        "summary": session.summary,
+        "turns": session.turns
+    }
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget a chat session"""
+    deleted = session_store.delete(session_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"deleted": session_id}
+
+@app.get("/api/admin/profiles")
+async def list_profiles(request: Request):
+    """Most recent request profiles, newest first"""
+    require_admin(request)
+    return {"profiles": profile_store.recent()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, format: str = "json"):
+    """One profile: span tree (json), cProfile table (text) or raw cProfile data (pstats)"""
+    require_admin(request)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    
+    if format == "json":
+        return json_response(profile.to_dict(), route="profiles")
+    if profile.cprofile_stats is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} has no cProfile data")
+    if format == "text":
+        return PlainTextResponse(profile.pstats_text())
+    if format == "pstats":
+        return Response(
+            content=profile.pstats_bytes(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="profile_{profile_id}.prof"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be json, text or pstats")
+
+def warm_caches_from_query_log(path: str, limit: int):
+    """Encode and search the most frequent logged retrievals (runs in a thread)"""
+    # Redacted or truncated queries were never searched as logged, so warming them is wasted work
+    entries = most_frequent([entry for entry in read_query_log(path) if replayable(entry)], limit)
+    if not entries:
+        return
+    
+    started = time.perf_counter()
+    texts = list(dict.fromkeys(query for entry in entries for query in (entry.get('queries') or [entry['query']])))
+    for i in range(0, len(texts), 64):
+        knowledge_processor.encode_queries(texts[i:i + 64])
+    
+    # Searching also loads the shards and index pages the common queries touch
+    for entry in entries:
+        try:
+            knowledge_processor.search_batch(
+                entry.get('queries') or [entry['query']],
+                entry['top_k'],
+                SearchFilters(**entry.get('filters', {}))
+            )
+        except Exception as e:
+            logger.warning(f"Cache warm-up search failed: {e}")
+            break
+    
+    logger.info(f"Warmed caches with {len(entries)} logged retrievals ({len(texts)} queries) in {time.perf_counter() - started:.2f}s")
+
+def build_knowledge_processor() -> KnowledgeProcessor:
+    """Build a fresh knowledge base from source files (CPU-bound, runs in a thread)"""
+    # Reuse the loaded encoder rather than loading a second copy
+    processor = KnowledgeProcessor(DATA_FOLDER, encoder=knowledge_processor.encoder if knowledge_processor else None)
+    if knowledge_processor:
+        # Same encoder, so cached query embeddings stay valid
+        processor.query_cache = knowledge_processor.query_cache
+    asyncio.run(processor.process_all_files())
+    processor.create_embeddings()
+    if PROJECTION_DIM:
+        processor.fit_projection(PROJECTION_DIM, PROJECTION_METHOD)
+    processor.create_faiss_index()
+    if NODE_ROLE == "shard":
+        processor = processor.partitioned(SHARD_INDEX, SHARD_COUNT)
+        processor.save_knowledge_base(PARTITION_PATH)
+        return processor
+    processor.save_knowledge_base(KNOWLEDGE_BASE_PATH)
+    if KB_SHARDED:
+        # The live processor may still lazily load shards from the active
+        # generation, so write a new one; it is published when swapped in
+        generation_dir = new_generation_dir(SHARD_DIR)
+        processor.save_shards(str(generation_dir))
+        processor.load_shards(str(generation_dir), SHARD_MEMORY_BUDGET_BYTES)
+    return processor
+
+async def run_rebuilds():
+    """Rebuild until no rerun was requested while the last rebuild ran"""
+    global knowledge_processor, rebuild_rerun_requested
+    
+    while True:
+        rebuild_rerun_requested = False
+        rebuild_metrics["started"] += 1
         try:
             logger.info("Starting knowledge base rebuild...")
             
-            # Reinitialize processor
-            knowledge_processor = KnowledgeProcessor("../Data")
-            await knowledge_processor.process_all_files()
-            knowledge_processor.create_embeddings()
-            knowledge_processor.create_faiss_index()
-            knowledge_processor.save_knowledge_base("knowledge_base")
+            # Build off the event loop and swap in atomically so searches keep
+            # using the old index until the new one is ready
+            rebuilt = await run_in_threadpool(build_knowledge_processor)
+            
+            async with knowledge_write_lock:
+                # Items written through the API are not in Data/, so carry them over
+                api_items = [
+                    item for item in knowledge_processor.live_items()
+                    if item.source_file.startswith(API_SOURCE_PREFIX)
+                ] if knowledge_processor else []
+                if api_items:
+                    await run_in_threadpool(rebuilt.upsert_items, api_items)
+                knowledge_processor = rebuilt
+            if rebuilt.shards is not None:
+                # Restarts load the generation now being served
+                await run_in_threadpool(publish_generation, SHARD_DIR, rebuilt.shards.shard_dir)
+            rebuild_metrics["completed"] += 1
             
             logger.info("Knowledge base rebuild completed successfully")
             
         except Exception as e:
+            rebuild_metrics["failed"] += 1
             logger.error(f"Error rebuilding knowledge base: {e}")
+        
+        if not rebuild_rerun_requested:
+            break
+
+@app.post("/api/knowledge/rebuild")
+async def rebuild_knowledge_base():
+    """Rebuild knowledge base from source files"""
+    global rebuild_task, rebuild_rerun_requested
+    
+    if NODE_ROLE == "coordinator":
+        raise HTTPException(status_code=409, detail="Rebuild each shard server instead of the coordinator")
+    
+    if rebuild_task is not None and not rebuild_task.done():
+        # Deduplicate: fold this request into one rerun after the current build
+        rebuild_rerun_requested = True
+        rebuild_metrics["deduplicated"] += 1
+        return {
+            "message": "Knowledge base rebuild already in progress; one more rebuild will follow it",
+            "status": "queued"
+        }
     
-    background_tasks.add_task(rebuild_task)
+    rebuild_task = asyncio.create_task(run_rebuilds())
     
     return {
         "message": "Knowledge base rebuild started in background",
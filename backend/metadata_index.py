@@ -0,0 +1,154 @@
+import zlib
+import base64
+import logging
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FACETS = ('category', 'tag', 'source')
+
+
+@dataclass
+class SearchFilters:
+    """Boolean metadata filters; facets are ANDed together"""
+    categories: List[str] = field(default_factory=list)    # any of
+    tags_any: List[str] = field(default_factory=list)      # any of
+    tags_all: List[str] = field(default_factory=list)      # all of
+    exclude_tags: List[str] = field(default_factory=list)  # none of
+    sources: List[str] = field(default_factory=list)       # any of (file names)
+
+    def is_empty(self) -> bool:
+        return not (self.categories or self.tags_any or self.tags_all or self.exclude_tags or self.sources)
+
+    def cache_key(self) -> Dict[str, List[str]]:
+        """Order-independent representation for cache and coalescing keys"""
+        return {name: sorted(values) for name, values in self.__dict__.items() if values}
+
+
+def source_name(source_file: str) -> str:
+    """Facet value for a source file: its file name"""
+    return Path(source_file).name
+
+
+def item_sources(item: Any) -> Set[str]:
+    """Source facet values of an item, including files whose duplicate was collapsed into it"""
+    return {source_name(source_file) for source_file in [item.source_file] + getattr(item, 'duplicate_sources', [])}
+
+
+class MetadataIndex:
+    """Inverted index from category/tag/source values to item-position bitmaps.
+
+    Bitmaps are Python ints (bit i set when knowledge_items[i] has the value),
+    so boolean filters are single big-int AND/OR operations. Facet counts are
+    precomputed at build time, and bitmaps are zlib-compressed when persisted.
+    """
+
+    def __init__(self, num_items: int = 0):
+        self.num_items = num_items
+        self.bitmaps: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+        self.counts: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+
+    @classmethod
+    def build(cls, items: List[Any]) -> "MetadataIndex":
+        """Build the index from knowledge items in index order"""
+        index = cls(len(items))
+        for position, item in enumerate(items):
+            index.add(position, item)
+        return index
+
+    def add(self, position: int, item: Any):
+        """Set the bits for one item"""
+        bit = 1 << position
+        values = {
+            'category': [item.category],
+            'tag': set(item.tags),
+            'source': item_sources(item)
+        }
+        for facet, facet_values in values.items():
+            for value in facet_values:
+                self.bitmaps[facet][value] = self.bitmaps[facet].get(value, 0) | bit
+                self.counts[facet][value] = self.counts[facet].get(value, 0) + 1
+        self.num_items = max(self.num_items, position + 1)
+
+    def remove(self, position: int, item: Any):
+        """Clear the bits for one item"""
+        bit = 1 << position
+        values = {
+            'category': [item.category],
+            'tag': set(item.tags),
+            'source': item_sources(item)
+        }
+        for facet, facet_values in values.items():
+            for value in facet_values:
+                bitmap = self.bitmaps[facet].get(value, 0)
+                if bitmap & bit:
+                    bitmap &= ~bit
+                    self.counts[facet][value] -= 1
+                    if bitmap:
+                        self.bitmaps[facet][value] = bitmap
+                    else:
+                        del self.bitmaps[facet][value]
+                        del self.counts[facet][value]
+
+    def facet_counts(self, facet: str) -> Dict[str, int]:
+        """Item count per value of a facet"""
+        return self.counts[facet]
+
+    def _any(self, facet: str, values: List[str]) -> int:
+        bitmap = 0
+        for value in values:
+            bitmap |= self.bitmaps[facet].get(value, 0)
+        return bitmap
+
+    def resolve(self, filters: Optional[SearchFilters]) -> Optional[int]:
+        """Bitmap of items matching the filters, or None when nothing is filtered"""
+        if filters is None or filters.is_empty():
+            return None
+
+        bitmap = (1 << self.num_items) - 1
+        if filters.categories:
+            bitmap &= self._any('category', filters.categories)
+        if filters.tags_any:
+            bitmap &= self._any('tag', filters.tags_any)
+        for tag in filters.tags_all:
+            bitmap &= self.bitmaps['tag'].get(tag, 0)
+        if filters.exclude_tags:
+            bitmap &= ~self._any('tag', filters.exclude_tags)
+        if filters.sources:
+            bitmap &= self._any('source', [source_name(source) for source in filters.sources])
+        return bitmap
+
+    def to_mask(self, bitmap: int) -> np.ndarray:
+        """Boolean numpy mask over item positions for a bitmap"""
+        num_bytes = (self.num_items + 7) // 8
+        packed = np.frombuffer(bitmap.to_bytes(num_bytes, 'little'), dtype=np.uint8)
+        return np.unpackbits(packed, bitorder='little')[:self.num_items].astype(bool)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable form with compressed bitmaps"""
+        num_bytes = (self.num_items + 7) // 8
+
+        def encode(bitmap: int) -> str:
+            return base64.b64encode(zlib.compress(bitmap.to_bytes(num_bytes, 'little'))).decode('ascii')
+
+        return {
+            'num_items': self.num_items,
+            'bitmaps': {
+                facet: {value: encode(bitmap) for value, bitmap in values.items()}
+                for facet, values in self.bitmaps.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetadataIndex":
+        index = cls(data['num_items'])
+        for facet, values in data['bitmaps'].items():
+            for value, encoded in values.items():
+                bitmap = int.from_bytes(zlib.decompress(base64.b64decode(encoded)), 'little')
+                index.bitmaps[facet][value] = bitmap
+                index.counts[facet][value] = bin(bitmap).count('1')
+        return index
@@ -0,0 +1,159 @@
+import os
+import re
+import gzip
+import json
+import logging
+from typing import List, Dict, Any, Optional
+
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Optional fast paths; fall back to the standard library when not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+DEFAULT_SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "240"))
+
+# Per-route payload size metrics
+payload_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_str(payload: Any) -> str:
+    return dumps(payload).decode('utf-8')
+
+
+def _passages(content: str) -> List[tuple]:
+    """(start, end) offsets of sentence/line passages in content"""
+    spans = []
+    for match in re.finditer(r'[^\n.!?]+[.!?]?', content):
+        if match.group().strip():
+            spans.append((match.start(), match.end()))
+    return spans or [(0, len(content))]
+
+
+def extract_snippet(content: str, query: str, max_chars: int = DEFAULT_SNIPPET_CHARS) -> Dict[str, Any]:
+    """Window of content around the passage that best matches the query terms.
+
+    Returns the snippet text with its character offsets into the original
+    content, so clients can highlight or fetch surrounding text.
+    """
+    terms = {term for term in re.findall(r'\w+', query.lower()) if len(term) > 2}
+
+    best_span = (0, min(len(content), max_chars))
+    best_score = 0
+    if terms:
+        for start, end in _passages(content):
+            words = re.findall(r'\w+', content[start:end].lower())
+            score = sum(1 for word in words if word in terms)
+            if score > best_score:
+                best_score, best_span = score, (start, end)
+
+    # Expand or trim the passage to the snippet budget, centred on the match
+    start, end = best_span
+    if end - start > max_chars:
+        end = start + max_chars
+    else:
+        padding = (max_chars - (end - start)) // 2
+        start = max(0, start - padding)
+        end = min(len(content), start + max_chars)
+        start = max(0, end - max_chars)
+
+    text = content[start:end].strip()
+    leading = len(content[start:end]) - len(content[start:end].lstrip())
+    return {
+        'text': text,
+        'start': start + leading,
+        'end': start + leading + len(text)
+    }
+
+
+def project_results(results: List[Dict[str, Any]],
+                    fields: Optional[List[str]],
+                    query: str = "",
+                    snippet_chars: int = DEFAULT_SNIPPET_CHARS) -> List[Dict[str, Any]]:
+    """Keep only the requested fields; "snippet" adds a query-centred excerpt
+    and "score" the best available relevance score.
+
+    fields=None returns results unchanged for backward compatibility.
+    """
+    if fields is None:
+        return results
+
+    wanted = set(fields)
+    projected = []
+    for item in results:
+        lean = {field: item[field] for field in fields if field in item}
+        if 'score' in wanted:
+            # Best available relevance: cross-encoder, then bi-encoder similarity
+            lean['score'] = item.get('rerank_score', item.get('similarity_score'))
+        if 'snippet' in wanted and 'content' in item:
+            lean['snippet'] = extract_snippet(item['content'], query, snippet_chars)
+        projected.append(lean)
+    return projected
+
+
+def _negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {part.split(';')[0].strip().lower() for part in accept_encoding.split(',') if part.strip()}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def json_response(payload: Any, route: str, accept_encoding: str = "") -> Response:
+    """Fast-encoded JSON response, compressed when large and the client accepts it"""
+    body = dumps(payload)
+    metrics = payload_metrics.setdefault(route, {
+        'responses': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'compressed': 0, 'max_raw_bytes': 0
+    })
+    metrics['responses'] += 1
+    metrics['raw_bytes'] += len(body)
+    metrics['max_raw_bytes'] = max(metrics['max_raw_bytes'], len(body))
+
+    headers = {'Vary': 'Accept-Encoding'}
+    encoding = _negotiate_encoding(accept_encoding) if len(body) >= COMPRESSION_MIN_BYTES else None
+    if encoding == 'br':
+        body = brotli.compress(body, quality=4)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=5)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        metrics['compressed'] += 1
+
+    metrics['sent_bytes'] += len(body)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def get_payload_stats() -> Dict[str, Any]:
+    stats = {}
+    for route, metrics in payload_metrics.items():
+        responses = metrics['responses']
+        stats[route] = {
+            **metrics,
+            'avg_raw_bytes': metrics['raw_bytes'] / responses if responses else 0,
+            'avg_sent_bytes': metrics['sent_bytes'] / responses if responses else 0,
+            'compression_ratio': metrics['sent_bytes'] / metrics['raw_bytes'] if metrics['raw_bytes'] else 1.0
+        }
+    return {
+        'routes': stats,
+        'orjson': orjson is not None,
+        'brotli': brotli is not None,
+        'compression_min_bytes': COMPRESSION_MIN_BYTES
+    }
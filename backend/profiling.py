@@ -0,0 +1,262 @@
+import io
+import os
+import hmac
+import time
+import uuid
+import random
+import marshal
+import pstats
+import cProfile
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "false").lower() in ("1", "true", "yes", "on")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+# Required by X-Debug-Profile and the /api/admin endpoints; unset disables both
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# The span new spans attach to; None means the request is not being profiled
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """Timed node in a per-request span tree"""
+
+    __slots__ = ('name', 'attrs', 'children', 'started', 'duration_ms', '_token')
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.started = 0.0
+        self.duration_ms: Optional[float] = None
+        self._token = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000.0
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. a stream closed by a different task
+            pass
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'start_ms': round((self.started - origin) * 1000.0, 3),
+            'duration_ms': round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            'attrs': self.attrs,
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+
+class _NoopSpan:
+    """Returned when the request is not profiled, so disabled spans cost one lookup"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager timing a child of the current span (no-op when not profiling)"""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    child = Span(name, attrs)
+    parent.children.append(child)
+    return child
+
+
+class RequestProfile:
+    def __init__(self, route: str, method: str, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.method = method
+        self.reason = reason
+        self.created_at = datetime.now().isoformat()
+        self.root = Span(route, {})
+        self.status: Optional[int] = None
+        self.cprofile_stats: Optional[Dict[Any, Any]] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'route': self.route,
+            'method': self.method,
+            'reason': self.reason,
+            'created_at': self.created_at,
+            'status': self.status,
+            'duration_ms': round(self.root.duration_ms, 3) if self.root.duration_ms is not None else None,
+            'has_cprofile': self.cprofile_stats is not None
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.summary(), 'spans': self.root.to_dict(self.root.started)}
+
+    def pstats_bytes(self) -> bytes:
+        """cProfile data in the format pstats.Stats/snakeviz load"""
+        return marshal.dumps(self.cprofile_stats)
+
+    def pstats_text(self, limit: int = 60) -> str:
+        output = io.StringIO()
+        pstats.Stats(_CapturedStats(self.cprofile_stats), stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+class _CapturedStats:
+    """Already-collected cProfile stats in the shape pstats.Stats loads from"""
+
+    def __init__(self, stats: Dict[Any, Any]):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfileStore:
+    """Most recent request profiles, oldest dropped first"""
+
+    def __init__(self, max_profiles: int = PROFILE_KEEP):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {'sampled': 0, 'requested': 0, 'cprofile_skipped': 0, 'unauthorized': 0}
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profile.summary() for profile in reversed(profiles)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.metrics, 'stored': len(self._profiles), 'sample_rate': PROFILE_SAMPLE_RATE}
+
+
+def admin_token_valid(token: Optional[str], expected: str = ADMIN_TOKEN) -> bool:
+    """Whether a request's admin token matches the configured one (never when none is configured)"""
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling a sample of requests on selected paths.
+
+    A request is profiled when it carries the debug header ("1" for spans,
+    "cprofile" to add cProfile output) together with a valid admin token,
+    or falls in the PROFILE_SAMPLE_RATE sample. Without ADMIN_TOKEN the
+    header is ignored. cProfile observes the event loop thread, so it also sees other
+    requests running concurrently; only one request is cProfiled at a time.
+    """
+
+    DEBUG_HEADER = b"x-debug-profile"
+    TOKEN_HEADER = b"x-admin-token"
+
+    def __init__(self,
+                 app,
+                 paths: List[str],
+                 store: ProfileStore,
+                 sample_rate: float = PROFILE_SAMPLE_RATE,
+                 admin_token: str = ADMIN_TOKEN):
+        self.app = app
+        self.paths = set(paths)
+        self.store = store
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self._cprofile_active = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        mode = None
+        token = None
+        for name, value in scope.get("headers", []):
+            if name == self.DEBUG_HEADER:
+                mode = value.decode("latin-1").strip().lower()
+            elif name == self.TOKEN_HEADER:
+                token = value.decode("latin-1").strip()
+        if mode not in (None, "", "0", "false") and not admin_token_valid(token, self.admin_token):
+            self.store.metrics['unauthorized'] += 1
+            mode = None
+        if mode in (None, "", "0", "false"):
+            if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+                await self.app(scope, receive, send)
+                return
+            reason = "sampled"
+            use_cprofile = PROFILE_CPROFILE
+            self.store.metrics['sampled'] += 1
+        else:
+            reason = "requested"
+            use_cprofile = mode == "cprofile"
+            self.store.metrics['requested'] += 1
+
+        profile = RequestProfile(scope["path"], scope.get("method", ""), reason)
+
+        profiler = None
+        if use_cprofile:
+            if self._cprofile_active:
+                self.store.metrics['cprofile_skipped'] += 1
+                profile.root.set(cprofile="skipped: another request is being cProfiled")
+            else:
+                self._cprofile_active = True
+                profiler = cProfile.Profile()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+                }
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.enable()
+            with profile.root:
+                await self.app(scope, receive, send_with_profile_id)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                profile.cprofile_stats = profiler.stats
+                self._cprofile_active = False
+            self.store.add(profile)
@@ -0,0 +1,75 @@
+import logging
+from typing import Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_METHODS = ('pca', 'random')
+
+
+class EmbeddingProjection:
+    """Linear map from full-dimension embeddings to a smaller search space.
+
+    "pca" keeps the top principal directions of the (uncentered) corpus
+    vectors, "random" a random rotation truncated to the target dimension.
+    Projected vectors are re-normalized, so scores stay cosine similarities
+    (in the reduced space); corpus and query vectors must both be projected.
+    """
+
+    def __init__(self, method: str, components: np.ndarray):
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method: {method}")
+        self.method = method
+        # (input_dim, output_dim)
+        self.components = components.astype('float32')
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, target_dim: int, method: str = 'pca', seed: int = 0) -> "EmbeddingProjection":
+        """Learn a projection from unit-normalized corpus vectors"""
+        input_dim = vectors.shape[1]
+        if not 0 < target_dim < input_dim:
+            raise ValueError(f"Target dimension must be between 1 and {input_dim - 1}, got {target_dim}")
+
+        if method == 'pca':
+            # No centering: centering would change inner products and so rankings
+            _, _, vt = np.linalg.svd(vectors.astype('float64'), full_matrices=False)
+            components = vt[:target_dim].T
+            if components.shape[1] < target_dim:
+                raise ValueError(f"PCA needs at least {target_dim} items, got {len(vectors)}")
+        elif method == 'random':
+            rng = np.random.default_rng(seed)
+            rotation, _ = np.linalg.qr(rng.normal(size=(input_dim, input_dim)))
+            components = rotation[:, :target_dim]
+        else:
+            raise ValueError(f"Unknown projection method: {method}")
+
+        logger.info(f"Fitted {method} projection {input_dim} -> {target_dim}")
+        return cls(method, components)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """Project and re-normalize; vectors already in the output space pass through"""
+        if vectors.shape[1] == self.output_dim:
+            return vectors.astype('float32', copy=False)
+        projected = vectors.astype('float32', copy=False) @ self.components
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return (projected / np.maximum(norms, 1e-12)).astype('float32', copy=False)
+
+    def describe(self) -> Dict[str, Any]:
+        return {'method': self.method, 'input_dim': self.input_dim, 'output_dim': self.output_dim}
+
+    def save(self, path: str):
+        np.savez(path, method=np.array(self.method), components=self.components)
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingProjection":
+        data = np.load(path)
+        return cls(str(data['method']), data['components'])
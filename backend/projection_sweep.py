@@ -0,0 +1,86 @@
+"""Sweep embedding projection sizes against full-dimension flat search.
+
+    python projection_sweep.py --kb knowledge_base --dims 32 64 128 192 --k 10
+
+For each method and target dimension, reports recall@k against the exact
+full-dimension results, index memory and per-query search latency.
+Queries come from --queries (one per line) or default to item titles.
+"""
+import time
+import argparse
+import random
+
+import faiss
+import numpy as np
+
+from knowledge_processor import KnowledgeProcessor
+from projection import EmbeddingProjection, PROJECTION_METHODS
+
+
+def timed_search(vectors: np.ndarray, queries: np.ndarray, k: int, repeats: int):
+    """Flat inner-product search; returns (indices, ms per query)"""
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(x=vectors)
+    _, indices = index.search(queries, k)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        index.search(queries, k)
+    elapsed = time.perf_counter() - started
+    return indices, elapsed / (repeats * len(queries)) * 1000.0
+
+
+def recall_at_k(exact: np.ndarray, approx: np.ndarray) -> float:
+    hits = [len(set(e[e >= 0]) & set(a[a >= 0])) / max(1, (e >= 0).sum()) for e, a in zip(exact, approx)]
+    return float(np.mean(hits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/memory/latency of embedding projections")
+    parser.add_argument("--kb", default="knowledge_base", help="Knowledge base path prefix")
+    parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 96, 128, 192, 256])
+    parser.add_argument("--methods", nargs="+", default=list(PROJECTION_METHODS), choices=PROJECTION_METHODS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", help="File with one query per line")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    processor = KnowledgeProcessor("../Data")
+    processor.load_knowledge_base(args.kb)
+    items = processor.live_items()
+    # Per-item embeddings are the raw encoder output, whatever space the index uses
+    corpus = np.stack([item.embedding for item in items]).astype('float32')
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = [item.title for item in random.Random(0).sample(items, min(args.num_queries, len(items)))]
+    queries = processor.encoder.encode(texts)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    k = min(args.k, len(items))
+    exact, full_ms = timed_search(corpus, queries, k, args.repeats)
+    full_bytes = corpus.nbytes
+    print(f"{len(items)} items, {len(texts)} queries, full dimension {corpus.shape[1]}: "
+          f"{full_bytes / 1e6:.2f} MB, {full_ms:.3f} ms/query")
+    print(f"{'method':<8} {'dim':>5} {'recall@' + str(k):>10} {'memory MB':>10} {'saved':>7} {'ms/query':>9} {'speedup':>8}")
+
+    for method in args.methods:
+        for dim in args.dims:
+            if dim >= corpus.shape[1]:
+                continue
+            try:
+                projection = EmbeddingProjection.fit(corpus, dim, method)
+            except ValueError as e:
+                print(f"{method:<8} {dim:>5} skipped: {e}")
+                continue
+            projected = projection.project(corpus)
+            approx, ms = timed_search(projected, projection.project(queries), k, args.repeats)
+            print(f"{method:<8} {dim:>5} {recall_at_k(exact, approx):>10.3f} {projected.nbytes / 1e6:>10.2f} "
+                  f"{1 - projected.nbytes / full_bytes:>7.0%} {ms:>9.3f} {full_ms / ms if ms else 0:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
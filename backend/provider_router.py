@@ -0,0 +1,283 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncGenerator, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderUnavailableError(Exception):
+    """Raised when no AI provider could produce a response"""
+    pass
+
+
+class LatencyTracker:
+    """Rolling window of latency samples (milliseconds) with percentile lookup"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency_ms: float):
+        self.samples.append(latency_ms)
+
+    @property
+    def count(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial request"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    def is_available(self) -> bool:
+        """Whether a request may be sent to this provider now"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown_s:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            return not self.trial_in_flight
+        return self.state == self.CLOSED
+
+    def on_launch(self):
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def record_cancelled(self):
+        """A hedged loser was cancelled; it neither succeeded nor failed"""
+        self.trial_in_flight = False
+
+
+async def _next_chunk(stream: AsyncGenerator[str, None]) -> Tuple[bool, Optional[str]]:
+    """Pull one chunk, reporting exhaustion instead of raising StopAsyncIteration"""
+    try:
+        return True, await stream.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+class ProviderRouter:
+    """Route streaming calls across providers with hedging and circuit breaking.
+
+    The first available provider is tried first. If it has not produced a
+    first token within a percentile of its recent first-token latency, the
+    next provider is started as a hedge; whichever yields first wins and the
+    other is cancelled. Failures before the first token fail over to the next
+    provider, and providers with open circuits are skipped.
+    """
+
+    def __init__(self,
+                 backends: List[Any],
+                 hedge_enabled: bool = True,
+                 hedge_percentile: float = 95.0,
+                 min_hedge_delay_ms: float = 50.0,
+                 default_hedge_delay_ms: float = 2000.0,
+                 min_samples: int = 10,
+                 failure_threshold: int = 3,
+                 cooldown_s: float = 30.0):
+        if not backends:
+            raise ValueError("At least one provider backend is required")
+
+        self.backends = backends
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay_ms = min_hedge_delay_ms
+        self.default_hedge_delay_ms = default_hedge_delay_ms
+        self.min_samples = min_samples
+
+        self.first_token_latency = {backend.name: LatencyTracker() for backend in backends}
+        self.total_latency = {backend.name: LatencyTracker() for backend in backends}
+        self.breakers = {backend.name: CircuitBreaker(failure_threshold, cooldown_s) for backend in backends}
+        self.provider_metrics = {
+            backend.name: {'attempts': 0, 'wins': 0, 'failures': 0, 'cancelled': 0}
+            for backend in backends
+        }
+        self.metrics = {
+            'requests': 0,
+            'hedges_fired': 0,
+            'hedge_wins': 0,
+            'failovers': 0,
+            'failed_mid_stream': 0,
+            'unavailable': 0
+        }
+
+    def hedge_delay_ms(self, backend: Any) -> float:
+        """Delay before hedging a request to this provider"""
+        tracker = self.first_token_latency[backend.name]
+        if tracker.count < self.min_samples:
+            return self.default_hedge_delay_ms
+        return max(self.min_hedge_delay_ms, tracker.percentile(self.hedge_percentile))
+
+    def _available_backends(self) -> List[Any]:
+        return [backend for backend in self.backends if self.breakers[backend.name].is_available()]
+
+    def _record_failure(self, backend: Any, error: BaseException):
+        logger.warning(f"Provider {backend.name} failed: {error}")
+        self.provider_metrics[backend.name]['failures'] += 1
+        self.breakers[backend.name].record_failure()
+
+    async def _discard(self, task: asyncio.Future, stream: AsyncGenerator[str, None], backend: Any):
+        """Cancel a losing attempt and close its upstream stream"""
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
+        self.provider_metrics[backend.name]['cancelled'] += 1
+        self.breakers[backend.name].record_cancelled()
+
+    async def _race_first_token(self, candidates: List[Any], call: Callable[[Any], AsyncGenerator[str, None]]):
+        """Start providers (hedging on delay, failing over on error) until one yields"""
+        remaining = list(candidates)
+        pending: Dict[asyncio.Future, Tuple[Any, AsyncGenerator[str, None], float]] = {}
+        errors = []
+
+        def launch():
+            backend = remaining.pop(0)
+            stream = call(backend)
+            self.breakers[backend.name].on_launch()
+            self.provider_metrics[backend.name]['attempts'] += 1
+            task = asyncio.ensure_future(_next_chunk(stream))
+            pending[task] = (backend, stream, time.perf_counter())
+            return backend
+
+        first = newest = launch()
+        hedged = False
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_enabled and remaining:
+                    timeout = self.hedge_delay_ms(newest) / 1000.0
+
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.metrics['hedges_fired'] += 1
+                    hedged = True
+                    newest = launch()
+                    continue
+
+                winner = None
+                for task in done:
+                    backend, stream, started = pending.pop(task)
+                    if winner is not None:
+                        await self._discard(task, stream, backend)
+                        continue
+                    try:
+                        has_chunk, chunk = task.result()
+                    except Exception as e:
+                        self._record_failure(backend, e)
+                        errors.append(f"{backend.name}: {e}")
+                        try:
+                            await stream.aclose()
+                        except Exception:
+                            pass
+                        continue
+                    winner = (backend, stream, started, has_chunk, chunk)
+
+                if winner is not None:
+                    backend, _, started, _, _ = winner
+                    self.first_token_latency[backend.name].record((time.perf_counter() - started) * 1000.0)
+                    if hedged and backend is not first:
+                        self.metrics['hedge_wins'] += 1
+                    return winner
+
+                # Every finished attempt failed: fail over if nothing else is running
+                if not pending and remaining:
+                    self.metrics['failovers'] += 1
+                    newest = launch()
+        finally:
+            for task, (backend, stream, _) in list(pending.items()):
+                await self._discard(task, stream, backend)
+            pending.clear()
+
+        raise ProviderUnavailableError("All AI providers failed: " + "; ".join(errors))
+
+    async def stream(self, call: Callable[[Any], AsyncGenerator[str, None]]) -> AsyncGenerator[str, None]:
+        """Stream chunks from the fastest healthy provider"""
+        self.metrics['requests'] += 1
+        candidates = self._available_backends()
+        if not candidates:
+            self.metrics['unavailable'] += 1
+            raise ProviderUnavailableError("All AI providers are unavailable (circuit open)")
+
+        try:
+            backend, stream, started, has_chunk, chunk = await self._race_first_token(candidates, call)
+        except ProviderUnavailableError:
+            self.metrics['unavailable'] += 1
+            raise
+
+        try:
+            if has_chunk:
+                yield chunk
+                async for chunk in stream:
+                    yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breakers[backend.name].record_cancelled()
+            raise
+        except Exception as e:
+            self._record_failure(backend, e)
+            self.metrics['failed_mid_stream'] += 1
+            # Too late to fail over once chunks were sent; report it like any provider failure
+            raise ProviderUnavailableError(f"{backend.name} failed mid-stream: {e}") from e
+        else:
+            self.breakers[backend.name].record_success()
+            self.provider_metrics[backend.name]['wins'] += 1
+            self.total_latency[backend.name].record((time.perf_counter() - started) * 1000.0)
+        finally:
+            await stream.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-provider latency, circuit state and hedging metrics"""
+        providers = {}
+        for backend in self.backends:
+            first_token = self.first_token_latency[backend.name]
+            total = self.total_latency[backend.name]
+            breaker = self.breakers[backend.name]
+            providers[backend.name] = {
+                **self.provider_metrics[backend.name],
+                'circuit_state': breaker.state,
+                'circuit_opened': breaker.times_opened,
+                'first_token_p50_ms': first_token.percentile(50),
+                'first_token_p95_ms': first_token.percentile(95),
+                'total_p50_ms': total.percentile(50),
+                'total_p99_ms': total.percentile(99),
+                'hedge_delay_ms': self.hedge_delay_ms(backend)
+            }
+        return {**self.metrics, 'hedge_enabled': self.hedge_enabled, 'providers': providers}
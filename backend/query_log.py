@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_CHARS = 500
+
+# Personal data that should never reach the log
+_REDACTIONS = [
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'https?://\S+'), '<url>'),
+    (re.compile(r'\+?\d[\d\s().-]{7,}\d'), '<number>'),
+    (re.compile(r'\b[A-Z]{5}\d{4}[A-Z]\b'), '<id>'),  # PAN-style tax IDs
+]
+
+
+def normalize_query(text: str) -> str:
+    """Whitespace-collapsed query text; what gets encoded and cached at query time"""
+    return " ".join(text.split())
+
+
+def sanitize_query(text: str) -> str:
+    """Redact contact details and long numbers, collapse whitespace and truncate"""
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return normalize_query(text)[:MAX_QUERY_CHARS]
+
+
+def replayable(entry: Dict[str, Any]) -> bool:
+    """Whether an entry's logged queries are the ones that were searched (not redacted or truncated)"""
+    return not entry.get('sanitized', False)
+
+
+class QueryLog:
+    """Append-only JSON-lines log of retrieval requests with size-based rotation.
+
+    Request handlers only enqueue a dict; serialization and file I/O happen
+    on a background thread. When the queue is full records are dropped
+    (and counted) rather than slowing requests down.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, max_pending: int = 10000):
+        self.path = path
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_pending)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self.metrics = {'recorded': 0, 'dropped': 0, 'write_errors': 0}
+        self._thread = threading.Thread(target=self._write_loop, name="query-log", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["QueryLog"]:
+        path = os.getenv("QUERY_LOG_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_bytes=int(float(os.getenv("QUERY_LOG_MAX_MB", "10")) * 1024 * 1024),
+            backup_count=int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+        )
+
+    def record(self,
+               route: str,
+               query: str,
+               top_k: int,
+               latency_ms: float,
+               result_ids: List[str],
+               filters: Optional[Dict[str, List[str]]] = None,
+               queries: Optional[List[str]] = None,
+               **extra):
+        """Queue one retrieval request for logging (never blocks)"""
+        entry = {
+            'ts': time.time(),
+            'route': route,
+            'query': query,
+            'top_k': top_k,
+            'filters': filters or {},
+            'latency_ms': round(latency_ms, 3),
+            'result_ids': result_ids,
+            **extra
+        }
+        if queries:
+            entry['queries'] = queries
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.metrics['dropped'] += 1
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            try:
+                # Sanitized here, off the request path. Whitespace is normalized
+                # at query time too, so only redaction or truncation makes an
+                # entry differ from what was actually searched
+                originals = [entry['query']] + entry.get('queries', [])
+                entry['query'] = sanitize_query(entry['query'])
+                if 'queries' in entry:
+                    entry['queries'] = [sanitize_query(query) for query in entry['queries']]
+                sanitized = [entry['query']] + entry.get('queries', [])
+                if any(after != normalize_query(before) for before, after in zip(originals, sanitized)):
+                    entry['sanitized'] = True
+                self._handler.emit(logging.makeLogRecord({'msg': json.dumps(entry, ensure_ascii=False)}))
+                self.metrics['recorded'] += 1
+            except Exception as e:
+                self.metrics['write_errors'] += 1
+                logger.warning(f"Could not write query log entry: {e}")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._handler.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.metrics, 'pending': self._queue.qsize(), 'path': self.path}
+
+
+def read_query_log(path: str) -> List[Dict[str, Any]]:
+    """All entries from a log and its rotated backups, oldest first"""
+    backups = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        backups.append(f"{path}.{index}")
+        index += 1
+
+    entries = []
+    for file_path in list(reversed(backups)) + ([path] if os.path.exists(path) else []):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return entries
+
+
+def replay_key(entry: Dict[str, Any]) -> str:
+    """Identity of a logged retrieval, ignoring timing and results"""
+    return json.dumps({
+        'queries': entry.get('queries') or [entry['query']],
+        'top_k': entry['top_k'],
+        'filters': entry.get('filters', {})
+    }, sort_keys=True)
+
+
+def most_frequent(entries: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """The most frequent distinct retrievals, most frequent first"""
+    counts = Counter()
+    first_seen = {}
+    for entry in entries:
+        key = replay_key(entry)
+        counts[key] += 1
+        first_seen.setdefault(key, entry)
+    return [first_seen[key] for key, _ in counts.most_common(limit)]
@@ -0,0 +1,115 @@
+"""Replay a query log against knowledge base builds.
+
+    python replay_queries.py --log query_log.jsonl --kb knowledge_base
+    python replay_queries.py --log query_log.jsonl --kb old_kb --compare-kb knowledge_base
+
+With one build, results are compared against the IDs recorded in the log,
+skipping entries whose queries were redacted or truncated when logged; with
+two, the builds are compared with each other. Reports latency
+percentiles and result overlap@k. Reranking is not replayed.
+"""
+import os
+import time
+import argparse
+from typing import List, Dict, Any
+
+import numpy as np
+
+from knowledge_processor import KnowledgeProcessor
+from metadata_index import SearchFilters
+from query_log import read_query_log, most_frequent, replayable
+from shards import resolve_shard_dir
+
+
+def load_processor(path: str, encoder=None) -> KnowledgeProcessor:
+    """Load a knowledge base path prefix, or a shard directory (or root of shard generations)"""
+    processor = KnowledgeProcessor("../Data", encoder=encoder)
+    shard_dir = resolve_shard_dir(path) if os.path.isdir(path) else None
+    if shard_dir is not None:
+        processor.load_shards(str(shard_dir))
+    else:
+        processor.load_knowledge_base(path)
+    return processor
+
+
+def replay(processor: KnowledgeProcessor, entries: List[Dict[str, Any]]):
+    """Run each logged retrieval; returns (result ID lists, latencies in ms)"""
+    results, latencies = [], []
+    for entry in entries:
+        queries = entry.get('queries') or [entry['query']]
+        filters = SearchFilters(**entry.get('filters', {}))
+        started = time.perf_counter()
+        if len(queries) > 1:
+            items = processor.multi_query_search(queries, entry['top_k'], filters=filters)
+        else:
+            items = processor.search(queries[0], entry['top_k'], filters=filters)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        results.append([item['id'] for item in items])
+    return results, latencies
+
+
+def overlap(a: List[str], b: List[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(set(a) & set(b)) / max(len(a), len(b))
+
+
+def describe_latency(name: str, latencies: List[float]):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:<12} mean {np.mean(latencies):8.2f} ms   p50 {p50:8.2f}   p95 {p95:8.2f}   p99 {p99:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged retrievals against knowledge base builds")
+    parser.add_argument("--log", required=True, help="Query log path (rotated backups are included)")
+    parser.add_argument("--kb", required=True, help="Knowledge base path prefix or shard directory")
+    parser.add_argument("--compare-kb", help="Second build to compare against")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many entries")
+    parser.add_argument("--distinct", action="store_true", help="Replay each distinct retrieval once, most frequent first")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed entries run first on each build")
+    args = parser.parse_args()
+
+    entries = read_query_log(args.log)
+    if not args.compare_kb:
+        # Logged result IDs came from the original text, not the redacted one
+        skipped = sum(1 for entry in entries if not replayable(entry))
+        entries = [entry for entry in entries if replayable(entry)]
+        if skipped:
+            print(f"Skipping {skipped} redacted or truncated entries (their logged results are not comparable)")
+    if args.distinct:
+        entries = most_frequent(entries, args.limit or len(entries))
+    elif args.limit:
+        entries = entries[-args.limit:]
+    if not entries:
+        print("No log entries to replay")
+        return
+    print(f"Replaying {len(entries)} retrievals from {args.log}")
+
+    baseline = load_processor(args.kb)
+    replay(baseline, entries[:args.warmup])
+    baseline_results, baseline_latencies = replay(baseline, entries)
+    describe_latency("baseline", baseline_latencies)
+
+    if args.compare_kb:
+        candidate = load_processor(args.compare_kb, encoder=baseline.encoder)
+        replay(candidate, entries[:args.warmup])
+        candidate_results, candidate_latencies = replay(candidate, entries)
+        describe_latency("candidate", candidate_latencies)
+        print(f"latency change: {np.mean(candidate_latencies) / np.mean(baseline_latencies) - 1:+.1%} (mean)")
+        reference, compared, label = baseline_results, candidate_results, "baseline vs candidate"
+    else:
+        reference, compared, label = [entry['result_ids'] for entry in entries], baseline_results, "logged vs replayed"
+
+    overlaps = [overlap(a, b) for a, b in zip(reference, compared)]
+    identical = sum(1 for a, b in zip(reference, compared) if a == b)
+    print(f"overlap@k ({label}): mean {np.mean(overlaps):.3f}   min {np.min(overlaps):.3f}   "
+          f"identical order {identical}/{len(entries)}")
+
+    changed = sorted(range(len(entries)), key=lambda i: overlaps[i])[:5]
+    for i in changed:
+        if overlaps[i] < 1.0:
+            print(f"  {overlaps[i]:.2f}  {entries[i]['query'][:80]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Rerank bi-encoder candidates with a cross-encoder under a latency budget.
+
+    Candidates are scored in batches. If the estimated or actual scoring time
+    would exceed the budget, the original bi-encoder order is returned instead.
+    Scores are cached by query and scored passage text, so repeated questions
+    are cheap and replaced items are scored afresh. The model loads on a
+    background thread; until it is ready requests keep the bi-encoder order
+    rather than paying for the load, and a failed load is retried with
+    exponential backoff.
+    """
+
+    # Each request skipped by the estimate shrinks it by this factor, so one
+    # slow batch cannot keep the reranker off for good
+    ESTIMATE_DECAY_ON_SKIP = 0.7
+    # Seconds before retrying a failed model load, doubling up to the maximum
+    LOAD_RETRY_S = 5.0
+    LOAD_RETRY_MAX_S = 300.0
+
+    def __init__(self,
+                 model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 budget_ms: float = 150.0,
+                 batch_size: int = 16,
+                 cache_size: int = 10000,
+                 max_chars: int = 1000):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_chars = max_chars
+        self.model = None
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+        self._load_failures = 0
+        self._load_retry_at = 0.0
+        self._cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        # Searches run in the threadpool, so cache access is serialized
+        self._cache_lock = threading.Lock()
+        # Exponential moving average of scoring cost per pair, used to skip hopeless batches
+        self._ms_per_pair: Optional[float] = None
+        self.metrics = {
+            'requests': 0,
+            'reranked': 0,
+            'budget_exceeded': 0,
+            'skipped_by_estimate': 0,
+            'model_not_ready': 0,
+            'load_failures': 0,
+            'errors': 0,
+            'pairs_scored': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'total_rerank_ms': 0.0
+        }
+
+    @classmethod
+    def from_env(cls) -> "CrossEncoderReranker":
+        """Build a reranker from environment configuration"""
+        return cls(
+            model_name=os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+            budget_ms=float(os.getenv("RERANK_BUDGET_MS", "150")),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+            cache_size=int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+        )
+
+    def _load_model(self):
+        """Load the cross-encoder once, then score a warm-up batch (not counted in the estimate)"""
+        with self._load_lock:
+            if self.model is not None:
+                return
+            try:
+                from sentence_transformers import CrossEncoder
+                logger.info(f"Loading cross-encoder {self.model_name}")
+                started = time.perf_counter()
+                model = CrossEncoder(self.model_name)
+                model.predict([["warm up", "warm up"]] * self.batch_size, batch_size=self.batch_size, show_progress_bar=False)
+                self.model = model
+                self._load_failures = 0
+                logger.info(f"Cross-encoder ready in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                self._load_failures += 1
+                retry_s = min(self.LOAD_RETRY_S * 2 ** (self._load_failures - 1), self.LOAD_RETRY_MAX_S)
+                self._load_retry_at = time.monotonic() + retry_s
+                self.metrics['load_failures'] += 1
+                logger.error(f"Could not load cross-encoder {self.model_name}: {e} (retrying in {retry_s:.0f}s)")
+            finally:
+                # Lets start_loading() try again after a failure
+                self._load_thread = None
+
+    def start_loading(self):
+        """Load the model on a background thread; safe to call repeatedly.
+
+        Does nothing while a load is running, once the model is loaded, or
+        during the backoff after a failed load.
+        """
+        with self._load_lock:
+            if self.model is not None or self._load_thread is not None or time.monotonic() < self._load_retry_at:
+                return
+            self._load_thread = threading.Thread(target=self._load_model, name="reranker-load", daemon=True)
+            self._load_thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def _passage(self, item: Dict[str, Any]) -> str:
+        return f"{item['title']}\n{item['content'][:self.max_chars]}"
+
+    def _cache_key(self, query: str, item: Dict[str, Any]) -> Tuple[str, str, str]:
+        # The passage digest keeps scores for an item's old content from surviving an upsert or rebuild
+        return query, item['id'], hashlib.blake2b(self._passage(item).encode('utf-8'), digest_size=8).hexdigest()
+
+    def _cache_get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._cache_lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: Tuple[str, str, str], score: float):
+        with self._cache_lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self,
+               query: str,
+               candidates: List[Dict[str, Any]],
+               top_k: int = 5,
+               budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Rerank candidates, falling back to bi-encoder order when over budget"""
+        self.metrics['requests'] += 1
+        if not candidates:
+            return []
+
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        scores: Dict[str, float] = {}
+        pending = []
+        for item in candidates:
+            cached = self._cache_get(self._cache_key(query, item))
+            if cached is None:
+                pending.append(item)
+            else:
+                scores[item['id']] = cached
+        self.metrics['cache_hits'] += len(candidates) - len(pending)
+        self.metrics['cache_misses'] += len(pending)
+
+        if pending and not self.ready:
+            self.start_loading()
+            self.metrics['model_not_ready'] += 1
+            return self._fallback(candidates, top_k)
+
+        if pending and self._ms_per_pair is not None and self._ms_per_pair * len(pending) > budget_ms:
+            self.metrics['skipped_by_estimate'] += 1
+            self.metrics['budget_exceeded'] += 1
+            # Scoring only happens when the estimate fits, so let it recover towards a retry
+            self._ms_per_pair *= self.ESTIMATE_DECAY_ON_SKIP
+            return self._fallback(candidates, top_k)
+
+        try:
+            model = self.model
+            start = time.perf_counter()
+            deadline = start + budget_ms / 1000.0
+
+            for batch_start in range(0, len(pending), self.batch_size):
+                if time.perf_counter() > deadline:
+                    self.metrics['budget_exceeded'] += 1
+                    return self._fallback(candidates, top_k)
+
+                batch = pending[batch_start:batch_start + self.batch_size]
+                pairs = [[query, self._passage(item)] for item in batch]
+
+                batch_start_time = time.perf_counter()
+                batch_scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                batch_ms = (time.perf_counter() - batch_start_time) * 1000.0
+                self._update_cost_estimate(batch_ms / len(batch))
+                self.metrics['pairs_scored'] += len(batch)
+
+                for item, score in zip(batch, batch_scores):
+                    scores[item['id']] = float(score)
+                    self._cache_put(self._cache_key(query, item), float(score))
+
+            if time.perf_counter() > deadline:
+                # Scores are cached for next time, but this request keeps its latency promise
+                self.metrics['budget_exceeded'] += 1
+                return self._fallback(candidates, top_k)
+
+        except Exception as e:
+            logger.error(f"Error reranking candidates: {e}")
+            self.metrics['errors'] += 1
+            return self._fallback(candidates, top_k)
+
+        ranked = sorted(candidates, key=lambda item: scores[item['id']], reverse=True)[:top_k]
+        results = []
+        for rank, item in enumerate(ranked):
+            item = dict(item)
+            item['rerank_score'] = scores[item['id']]
+            item['rank'] = rank + 1
+            results.append(item)
+
+        self.metrics['reranked'] += 1
+        self.metrics['total_rerank_ms'] += (time.perf_counter() - start) * 1000.0
+        return results
+
+    def _update_cost_estimate(self, ms_per_pair: float):
+        if self._ms_per_pair is None:
+            self._ms_per_pair = ms_per_pair
+        else:
+            self._ms_per_pair = 0.8 * self._ms_per_pair + 0.2 * ms_per_pair
+
+    def _fallback(self, candidates: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """Return the bi-encoder order unchanged"""
+        return candidates[:top_k]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Reranker metrics, including how often the latency budget was hit"""
+        requests = self.metrics['requests']
+        reranked = self.metrics['reranked']
+        return {
+            **self.metrics,
+            'budget_ms': self.budget_ms,
+            'budget_hit_rate': self.metrics['budget_exceeded'] / requests if requests else 0.0,
+            'avg_rerank_ms': self.metrics['total_rerank_ms'] / reranked if reranked else 0.0,
+            'estimated_ms_per_pair': self._ms_per_pair,
+            'cache_entries': len(self._cache),
+            'model_loaded': self.model is not None
+        }
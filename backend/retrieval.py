@@ -0,0 +1,95 @@
+import re
+import logging
+from typing import List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Words that carry no retrieval signal on their own
+STOPWORDS = {
+    'a', 'about', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'but', 'by',
+    'can', 'could', 'do', 'does', 'for', 'from', 'get', 'how', 'i', 'if', 'in',
+    'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'should', 'so', 'some',
+    'tell', 'that', 'the', 'then', 'there', 'this', 'to', 'was', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your',
+    'we', 'our', 'us', 'am', 'have', 'has', 'had', 'also', 'more', 'much',
+    'please', 'thanks', 'ok', 'okay', 'now', 'just', 'like', 'want', 'need'
+}
+
+# Reciprocal-rank-fusion damping constant (Cormack et al. use 60)
+RRF_K = 60
+
+
+def extract_keywords(text: str, max_keywords: int = 8) -> List[str]:
+    """Extract distinctive keywords from text, preserving first-seen order"""
+    keywords = []
+    seen = set()
+
+    for token in re.findall(r"[A-Za-z0-9][A-Za-z0-9+/#.-]*", text):
+        token = token.strip('.-')
+        lowered = token.lower()
+        if len(lowered) < 3 or lowered in STOPWORDS or lowered in seen:
+            continue
+        seen.add(lowered)
+        keywords.append(token)
+        if len(keywords) >= max_keywords:
+            break
+
+    return keywords
+
+
+def build_retrieval_queries(messages: List[Dict[str, str]], max_keywords: int = 8) -> List[str]:
+    """Derive retrieval queries from the conversation.
+
+    Produces the latest user turn, the latest turn joined with the previous
+    user turn (so follow-ups like "what about for tax?" keep their topic), and
+    a keyword query over both turns. Duplicates are dropped.
+    """
+    user_turns = [msg["content"].strip() for msg in messages if msg.get("role") == "user" and msg.get("content", "").strip()]
+    if not user_turns:
+        return []
+
+    latest = user_turns[-1]
+    queries = [latest]
+
+    if len(user_turns) > 1:
+        queries.append(f"{user_turns[-2]}\n{latest}")
+
+    keywords = extract_keywords(" ".join(user_turns[-2:]), max_keywords)
+    if keywords:
+        queries.append(" ".join(keywords))
+
+    unique_queries = []
+    for query in queries:
+        if query not in unique_queries:
+            unique_queries.append(query)
+
+    return unique_queries
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]],
+                           top_k: int = 5,
+                           k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Merge ranked result lists with reciprocal-rank fusion, deduplicating by item ID"""
+    fused_scores: Dict[str, float] = {}
+    best_items: Dict[str, Dict[str, Any]] = {}
+
+    for results in result_lists:
+        for position, item in enumerate(results):
+            item_id = item['id']
+            fused_scores[item_id] = fused_scores.get(item_id, 0.0) + 1.0 / (k + position + 1)
+
+            # Keep the copy with the highest similarity for display
+            current = best_items.get(item_id)
+            if current is None or item['similarity_score'] > current['similarity_score']:
+                best_items[item_id] = item
+
+    ranked_ids = sorted(fused_scores, key=lambda item_id: fused_scores[item_id], reverse=True)[:top_k]
+
+    merged = []
+    for rank, item_id in enumerate(ranked_ids):
+        item = dict(best_items[item_id])
+        item['fusion_score'] = fused_scores[item_id]
+        item['rank'] = rank + 1
+        merged.append(item)
+
+    return merged
@@ -0,0 +1,59 @@
+"""Run a local scatter-gather cluster: N shard servers plus one coordinator.
+
+    python run_cluster.py --shards 3 --port 8000
+
+Shards listen on port+1 .. port+N; the coordinator on port. Ctrl+C stops all.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+def start_node(port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env={**os.environ, **env}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run shard servers and a coordinator locally")
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--deadline-ms", type=int, default=500)
+    args = parser.parse_args()
+
+    processes = []
+    shard_urls = []
+    try:
+        for shard_index in range(args.shards):
+            port = args.port + 1 + shard_index
+            shard_urls.append(f"http://127.0.0.1:{port}")
+            processes.append(start_node(port, {
+                "NODE_ROLE": "shard",
+                "SHARD_INDEX": str(shard_index),
+                "SHARD_COUNT": str(args.shards)
+            }))
+
+        processes.append(start_node(args.port, {
+            "NODE_ROLE": "coordinator",
+            "SHARD_URLS": ",".join(shard_urls),
+            "SCATTER_DEADLINE_MS": str(args.deadline_ms)
+        }))
+        print(f"Coordinator on http://127.0.0.1:{args.port}, shards on {', '.join(shard_urls)}")
+
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import secrets
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def _summary_line(message: Dict[str, str], max_tokens: int) -> str:
+    text = " ".join(message["content"].split())
+    max_chars = max_tokens * 4
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + "..."
+    return f"{message['role'].capitalize()}: {text}"
+
+
+@dataclass
+class ChatSession:
+    id: str
+    # Recent turns sent verbatim to the provider
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    # Extractive summary lines of turns compacted out of the window
+    summary_lines: List[str] = field(default_factory=list)
+    last_active: float = field(default_factory=time.monotonic)
+    # (retrieval settings key, query, results) from the last retrieval
+    retrieval_context: Optional[tuple] = None
+    turns: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def window_tokens(self) -> int:
+        return sum(estimate_tokens(message["content"]) for message in self.messages)
+
+
+class SessionStore:
+    """Server-side chat history with bounded memory.
+
+    Each session keeps a token-bounded window of recent turns; older turns
+    are compacted into a short extractive summary that is itself
+    token-bounded. At most max_sessions stay in memory (least recently used
+    evicted first) and sessions idle for idle_ttl_s are dropped. With a
+    SQLite path, sessions are written through and reloaded after eviction.
+    """
+
+    def __init__(self,
+                 max_sessions: int = 1000,
+                 idle_ttl_s: float = 1800,
+                 window_tokens: int = 2000,
+                 summary_tokens: int = 400,
+                 line_tokens: int = 40,
+                 db_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.line_tokens = line_tokens
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.metrics = {
+            'created': 0, 'loaded': 0, 'evicted_idle': 0, 'evicted_capacity': 0,
+            'compacted_turns': 0, 'retrieval_reused': 0, 'retrieval_fresh': 0
+        }
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, messages TEXT NOT NULL, summary TEXT NOT NULL, "
+                "turns INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        return cls(
+            max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+            idle_ttl_s=float(os.getenv("SESSION_IDLE_TTL_S", "1800")),
+            window_tokens=int(os.getenv("SESSION_WINDOW_TOKENS", "2000")),
+            summary_tokens=int(os.getenv("SESSION_SUMMARY_TOKENS", "400")),
+            db_path=os.getenv("SESSION_DB_PATH") or None
+        )
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """Session from memory, or from SQLite when it was evicted"""
+        self.evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+            if session is None:
+                return None
+            self._insert(session)
+            self.metrics['loaded'] += 1
+        self._sessions.move_to_end(session_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def create(self) -> ChatSession:
+        """New session under a random server-chosen ID; the ID is what grants access to it"""
+        session = ChatSession(id=secrets.token_urlsafe(24))
+        self._insert(session)
+        self.metrics['created'] += 1
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        found = self._sessions.pop(session_id, None) is not None
+        if self._db is not None:
+            with self._db_lock:
+                found = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0 or found
+                self._db.commit()
+        return found
+
+    def _insert(self, session: ChatSession):
+        self._sessions[session.id] = session
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        # Sessions mid-turn are kept: a reload would not see the turn's changes
+        evictable = [
+            session_id for session_id, other in self._sessions.items()
+            if other is not session and not other.lock.locked()
+        ]
+        for session_id in evictable[:excess]:
+            del self._sessions[session_id]
+            self.metrics['evicted_capacity'] += 1
+
+    def evict_idle(self):
+        """Drop sessions idle for longer than idle_ttl_s (oldest are first), except those mid-turn"""
+        cutoff = time.monotonic() - self.idle_ttl_s
+        for session_id, session in list(self._sessions.items()):
+            if session.last_active >= cutoff:
+                break
+            if session.lock.locked():
+                continue
+            del self._sessions[session_id]
+            self.metrics['evicted_idle'] += 1
+
+    def append(self, session: ChatSession, role: str, content: str):
+        """Add a turn and compact the oldest turns into the summary when over budget"""
+        session.messages.append({"role": role, "content": content})
+        if role == "user":
+            session.turns += 1
+
+        # Always keep the latest message verbatim
+        while session.window_tokens() > self.window_tokens and len(session.messages) > 1:
+            session.summary_lines.append(_summary_line(session.messages.pop(0), self.line_tokens))
+            self.metrics['compacted_turns'] += 1
+
+        # The window must open with a user turn (Anthropic rejects a leading
+        # assistant message), so assistant replies left at the front follow
+        # their question into the summary
+        while session.messages and session.messages[0]["role"] != "user":
+            session.summary_lines.append(_summary_line(session.messages.pop(0), self.line_tokens))
+            self.metrics['compacted_turns'] += 1
+
+        while sum(estimate_tokens(line) for line in session.summary_lines) > self.summary_tokens and session.summary_lines:
+            session.summary_lines.pop(0)
+
+    def snapshot(self, session: ChatSession) -> tuple:
+        """State to restore with rollback() if the turn about to start fails"""
+        return list(session.messages), list(session.summary_lines), session.turns, session.retrieval_context
+
+    def rollback(self, session: ChatSession, snapshot: tuple):
+        """Undo a turn that failed before the assistant replied, including any compaction it caused"""
+        messages, summary_lines, turns, retrieval_context = snapshot
+        session.messages = list(messages)
+        session.summary_lines = list(summary_lines)
+        session.turns = turns
+        session.retrieval_context = retrieval_context
+
+    def save(self, session: ChatSession):
+        """Write a session through to SQLite (no-op without a database)"""
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, messages, summary, turns, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session.id, json.dumps(session.messages), json.dumps(session.summary_lines), session.turns, time.time())
+            )
+            self._db.commit()
+
+    def _load(self, session_id: str) -> Optional[ChatSession]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT messages, summary, turns FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return ChatSession(id=session_id, messages=json.loads(row[0]), summary_lines=json.loads(row[1]), turns=row[2])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            'active': len(self._sessions),
+            'max_sessions': self.max_sessions,
+            'idle_ttl_s': self.idle_ttl_s,
+            'window_tokens': self.window_tokens,
+            'persistent': self._db is not None
+        }
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable
+
+import numpy as np
+
+from metadata_index import SearchFilters
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Names the active generation directory under a shard root
+CURRENT_NAME = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+
+def shard_file_stem(category: str) -> str:
+    """File-system safe name for a category shard"""
+    return re.sub(r'[^\w-]', '_', category)
+
+
+def new_generation_dir(shard_root: str) -> Path:
+    """Fresh directory for a shard build; live shards are never written in place"""
+    name = f"{GENERATION_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    return Path(shard_root) / name
+
+
+def resolve_shard_dir(shard_root: str) -> Optional[Path]:
+    """Active generation under a shard root (or the root itself for a flat, older layout)"""
+    root = Path(shard_root)
+    pointer = root / CURRENT_NAME
+    if pointer.exists():
+        generation = root / pointer.read_text(encoding='utf-8').strip()
+        if (generation / MANIFEST_NAME).exists():
+            return generation
+    if (root / MANIFEST_NAME).exists():
+        return root
+    return None
+
+
+def publish_generation(shard_root: str, generation_dir: Path):
+    """Atomically make generation_dir the active generation, then prune old ones.
+
+    The previous generation is kept because searches still running on the
+    replaced processor may load shards from it; anything older (including
+    builds that failed before being published) is removed.
+    """
+    root = Path(shard_root)
+    pointer = root / CURRENT_NAME
+    previous = pointer.read_text(encoding='utf-8').strip() if pointer.exists() else None
+    pointer_tmp = root / f"{CURRENT_NAME}.tmp"
+    pointer_tmp.write_text(Path(generation_dir).name, encoding='utf-8')
+    os.replace(pointer_tmp, pointer)
+
+    keep = {Path(generation_dir).name, previous}
+    for path in root.iterdir():
+        if path.is_dir() and path.name.startswith(GENERATION_PREFIX) and path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def merge_top_k(result_lists: List[List[Dict[str, Any]]], top_k: int) -> List[Dict[str, Any]]:
+    """Merge per-shard result lists by similarity score and re-rank"""
+    merged = sorted(
+        (item for results in result_lists for item in results),
+        key=lambda item: item['similarity_score'],
+        reverse=True
+    )[:top_k]
+    for rank, item in enumerate(merged):
+        item['rank'] = rank + 1
+    return merged
+
+
+class ShardManager:
+    """Lazily loaded per-category index shards under a memory budget.
+
+    Shards are loaded on first use and kept in LRU order; when resident
+    memory exceeds the budget the coldest shards are evicted. A search only
+    touches the shards for the categories it enables.
+    """
+
+    def __init__(self,
+                 shard_dir: str,
+                 loader: Callable[[str], Any],
+                 memory_budget_bytes: int = 512 * 1024 * 1024):
+        self.shard_dir = Path(shard_dir)
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+
+        with open(self.shard_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        self._resident: "OrderedDict[str, Any]" = OrderedDict()
+        self._resident_bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load_locks = {category: threading.Lock() for category in self.manifest['shards']}
+        self.metrics = {'loads': 0, 'evictions': 0, 'hits': 0, 'load_seconds': 0.0}
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self.manifest['shards'])
+
+    def get(self, category: str):
+        """Return a loaded shard, loading it (and evicting cold shards) if needed"""
+        with self._lock:
+            shard = self._resident.get(category)
+            if shard is not None:
+                self._resident.move_to_end(category)
+                self.metrics['hits'] += 1
+                return shard
+
+        # Per-shard lock: concurrent first uses load once, other shards stay available
+        with self._load_locks[category]:
+            with self._lock:
+                shard = self._resident.get(category)
+                if shard is not None:
+                    self._resident.move_to_end(category)
+                    self.metrics['hits'] += 1
+                    return shard
+
+            started = time.perf_counter()
+            shard = self.loader(str(self.shard_dir / self.manifest['shards'][category]['path']))
+            elapsed = time.perf_counter() - started
+
+            with self._lock:
+                self._resident[category] = shard
+                self._resident_bytes[category] = shard.estimate_memory_bytes()
+                self.metrics['loads'] += 1
+                self.metrics['load_seconds'] += elapsed
+                self._evict_over_budget(keep=category)
+
+            logger.info(f"Loaded shard {category} ({self._resident_bytes.get(category, 0) / 1e6:.1f} MB) in {elapsed:.2f}s")
+            return shard
+
+    def _evict_over_budget(self, keep: str):
+        """Drop least recently used shards until within budget (caller holds the lock)"""
+        while sum(self._resident_bytes.values()) > self.memory_budget_bytes and len(self._resident) > 1:
+            category = next(iter(self._resident))
+            if category == keep:
+                self._resident.move_to_end(category)
+                category = next(iter(self._resident))
+            # In-flight searches keep their reference; memory is freed when they finish
+            del self._resident[category]
+            del self._resident_bytes[category]
+            self.metrics['evictions'] += 1
+            logger.info(f"Evicted shard {category}")
+
+    def search(self,
+               query_embeddings: np.ndarray,
+               top_k: int,
+               filters: Optional[SearchFilters] = None) -> List[List[Dict[str, Any]]]:
+        """Search the enabled shards and merge their top-k per query"""
+        categories = self.categories
+        shard_filters = filters
+        if filters is not None and filters.categories:
+            categories = [category for category in filters.categories if category in self.manifest['shards']]
+            # Category selection is done by choosing shards
+            shard_filters = SearchFilters(
+                tags_any=filters.tags_any,
+                tags_all=filters.tags_all,
+                exclude_tags=filters.exclude_tags,
+                sources=filters.sources
+            )
+
+        per_shard = [self.get(category).search_embeddings(query_embeddings, top_k, shard_filters) for category in categories]
+        return [
+            merge_top_k([shard_results[row] for shard_results in per_shard], top_k)
+            for row in range(len(query_embeddings))
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = {category: self._resident_bytes[category] for category in self._resident}
+        return {
+            **self.metrics,
+            'shards': len(self.manifest['shards']),
+            'resident_shards': list(resident),
+            'resident_bytes': sum(resident.values()),
+            'resident_bytes_by_shard': resident,
+            'memory_budget_bytes': self.memory_budget_bytes
+        }